@@ -362,7 +362,10 @@ def Undo():
         yield 'undid {}'.format(action.command)
 
 @vex_undo_list.on_run()
-def UndoList():
+@argspec('''
+    --limit:int # Only list the most recent commands
+''')
+def UndoList(limit):
     """
         List the commands that can be undone.
 
@@ -378,7 +381,7 @@ def UndoList():
     p = open_project()
 
     count = 0
-    for entry,redos in p.list_undos():
+    for entry,redos in p.list_undos(limit):
         count -= 1
         alternative = ""
         if len(redos) == 1:
@@ -421,7 +424,7 @@ def Redo(choice):
     p = open_project(allow_empty=True)
 
     with p.lock('redo') as p:
-        choices = p.list_redos()
+        choices = p.list_redos(1)
 
         if choices:
             choice = choice or 0
@@ -433,7 +436,10 @@ def Redo(choice):
 
 
 @vex_redo_list.on_run()
-def RedoList():
+@argspec('''
+    --limit:int # Only list the first choices
+''')
+def RedoList(limit):
     """
         List the commands that can be redone.
 
@@ -443,7 +449,7 @@ def RedoList():
     p = open_project(allow_empty=True)
 
     with p.lock('redo') as p:
-        choices = p.list_redos()
+        choices = p.list_redos(limit)
 
         if choices:
             for n, choice in enumerate(choices):
@@ -11,6 +11,7 @@
     - shelling out to diff
 
 """
+import copy
 import fnmatch
 import hashlib
 import subprocess
@@ -19,8 +20,10 @@ import os.path
 import sys
 import shutil
 import sqlite3
+import threading
 
 
+from collections import OrderedDict
 from contextlib import contextmanager
 from uuid import uuid4
 from datetime import datetime, timezone
@@ -28,6 +31,8 @@ from datetime import datetime, timezone
 def UUID(): return str(uuid4())
 def NOW(): return datetime.now(timezone.utc)
 
+HASH_CHUNK_SIZE = 1 << 20 # largest read when hashing a file
+
 
 try:
     import fcntl
@@ -89,6 +94,7 @@ class HistoryStore:
         self.file = file
         self._db = None
         self.codec = codec
+        self._batching = False
     
     @property
     def db(self):
@@ -97,6 +103,27 @@ class HistoryStore:
         self._db = sqlite3.connect(self.file)
         return self._db
 
+    def commit(self):
+        if not self._batching:
+            self.db.commit()
+
+    @contextmanager
+    def batch(self):
+        """ make the writes inside one sqlite commit, so they land together or not at all """
+        if self._batching:
+            # nested, the outermost batch commits or rolls back
+            yield
+            return
+        self._batching = True
+        try:
+            yield
+        except BaseException:
+            self._batching = False
+            self.db.rollback()
+            raise
+        self._batching = False
+        self.db.commit()
+
     def makedirs(self):
         c = self.db.cursor()
         c.execute('''
@@ -152,13 +179,13 @@ class HistoryStore:
         buf = self.codec.dump(value)
         c.execute('update current set value = ? where id = 0', [buf])
         c.execute('insert or ignore into current (id,value) values (0,?)',[buf])
-        self.db.commit()
+        self.commit()
 
     def set_next(self, mode, value, current):
         c = self.db.cursor() 
         c.execute('update next set mode = ?, value=?, current = ? where id = 0', [mode, value, current])
         c.execute('insert or ignore into next (id,mode, value,current) values (0,?,?,?)',[mode, value, current])
-        self.db.commit()
+        self.commit()
 
     def get_entry(self, addr):
         c = self.db.cursor() 
@@ -172,7 +199,7 @@ class HistoryStore:
         buf = self.codec.dump(obj)
         addr = UUID().split('-',1)[0]
         c.execute('insert into dos (addr, prev, action) values (?,?,?)',[addr, prev, buf])
-        self.db.commit()
+        self.commit()
         return addr
 
     def get_redos(self, addr):
@@ -188,9 +215,8 @@ class HistoryStore:
         c = self.db.cursor() 
         buf = ",".join(redo) if redo else ""
         c.execute('update redos set dos = ? where addr = ?', [buf, addr])
-        self.db.commit()
         c.execute('insert or ignore into redos (addr,dos) values (?,?)',[addr, buf])
-        self.db.commit()
+        self.commit()
 
 # Filename patterns
 
@@ -226,6 +252,7 @@ def file_diff(name, old, new):
 
 
 def list_dir(dir, ignore, include):
+    """ recursive, returns DirEntry objects so callers can reuse the cached is_dir/is_file """
     output = []
     scan = [dir]
     while scan:
@@ -235,18 +262,56 @@ def list_dir(dir, ignore, include):
                 p = f.path
                 if not match_filename(p, f.name, ignore, include): continue
                 if f.is_dir():
-                    output.append(p)
+                    output.append(f)
                     scan.append(p)
                 elif f.is_file():
-                    output.append(p)
+                    output.append(f)
     return output
+
+FICLONE = 0x40049409 # linux ioctl, share extents between files (btrfs, xfs)
+
+def copy_file(src, dest):
+    """ copy contents like shutil.copyfile, but let the kernel do it where it can """
+    if sys.platform.startswith('linux'):
+        with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+            infd, outfd = fsrc.fileno(), fdest.fileno()
+            try:
+                fcntl.ioctl(outfd, FICLONE, infd)
+                return
+            except OSError:
+                pass # not a reflink filesystem, or not the same one
+            if hasattr(os, 'copy_file_range'):
+                size = os.fstat(infd).st_size
+                try:
+                    offset = 0
+                    while offset < size:
+                        n = os.copy_file_range(infd, outfd, size - offset, offset, offset)
+                        if n == 0:
+                            break
+                        offset += n
+                    if offset >= size:
+                        return
+                    # some filesystems return 0 rather than raising, fall back to copyfile
+                except OSError:
+                    pass # e.g. unsupported filesystem, fall back to copyfile
+    shutil.copyfile(src, dest)
+
 # Stores
 
 class FileStore:
-    def __init__(self, dir, codec, rawkeys=()):
+    def __init__(self, dir, codec, rawkeys=(), cache_parsed=False):
         self.codec = codec
         self.dir = dir
         self.rawkeys = rawkeys
+        self._known = None
+        # name -> (stat signature, value), for files that may change behind our back
+        self._parsed = {} if cache_parsed else None
+
+    # while the project is locked nobody else writes, so remember what's on disk
+    def remember(self):
+        self._known = {}
+    def forget(self):
+        self._known = None
 
     def makedirs(self):
         os.makedirs(self.dir, exist_ok=True)
@@ -257,17 +322,51 @@ class FileStore:
             if os.path.isfile(self.filename(name)):
                 yield name
     def exists(self, addr):
+        if self._known is not None and addr in self._known:
+            return True
         return os.path.exists(self.filename(addr))
     def get(self, name):
+        if self._known is not None and name in self._known:
+            return self.parse(name, self._known[name])
+        if self._parsed is not None:
+            return self._get_parsed(name)
         if not self.exists(name):
             if name in self.rawkeys:
                 return ""
             return None
         with open(self.filename(name), 'rb') as fh:
-            return self.parse(name, fh.read())
+            buf = fh.read()
+        if self._known is not None:
+            self._known[name] = buf
+        return self.parse(name, buf)
+    def get_many(self, names, map=map):
+        """ name -> value for each name, pass executor.map to read the files side by side """
+        names = list(names)
+        return dict(zip(names, map(self.get, names)))
+    def _get_parsed(self, name):
+        try:
+            st = os.stat(self.filename(name))
+        except FileNotFoundError:
+            return "" if name in self.rawkeys else None
+        # set() rewrites in place, so the inode stays put and ctime catches quick same-size edits
+        key = (st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+        hit = self._parsed.get(name)
+        if hit is None or hit[0] != key:
+            with open(self.filename(name), 'rb') as fh:
+                hit = (key, self.parse(name, fh.read()))
+            self._parsed[name] = hit
+        # callers change what they get back before setting it
+        return copy.deepcopy(hit[1])
     def set(self, name, value):
+        buf = self.dump(name, value)
+        if self._parsed is not None:
+            self._parsed.pop(name, None)
+        if self._known is not None and self._known.get(name) == buf:
+            return
         with open(self.filename(name),'w+b') as fh:
-            fh.write(self.dump(name, value))
+            fh.write(buf)
+        if self._known is not None:
+            self._known[name] = buf
     def parse(self, name, value):
         if name in self.rawkeys:
             return value.decode('utf-8')
@@ -282,6 +381,53 @@ class FileStore:
         else:
             return self.codec.dump(value)
 
+class StatCache:
+    """ path -> (inode, mtime_ns, ctime_ns, size, addr), kept in a single file between runs """
+    def __init__(self, filename, codec, size=65536):
+        self.filename = filename
+        self.codec = codec
+        self.size = size
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.entries is None:
+            self.entries = OrderedDict()
+            if os.path.exists(self.filename):
+                try:
+                    with open(self.filename, 'rb') as fh:
+                        self.entries.update(self.codec.parse(fh.read()))
+                except Exception:
+                    pass # it's only a cache
+        return self.entries
+
+    def get(self, path, st):
+        with self.lock:
+            entry = self.load().get(path)
+            # ctime too, an in-place rewrite can keep mtime and size (rsync -t, touch -r)
+            if entry and entry[:4] == (st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size):
+                return entry[4]
+
+    def set(self, path, st, addr):
+        with self.lock:
+            entries = self.load()
+            entries[path] = (st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size, addr)
+            entries.move_to_end(path)
+            while len(entries) > self.size:
+                entries.popitem(last=False)
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp = "{}.tmp".format(self.filename)
+            with open(tmp, 'wb') as fh:
+                fh.write(self.codec.dump(dict(self.entries)))
+            os.replace(tmp, self.filename)
+            self.dirty = False
+
 class BlobStore:
     prefix = "vex:"
     def __init__(self, dir, codec):
@@ -301,7 +447,7 @@ class BlobStore:
         if other.exists(addr) and not self.exists(addr):
             src, dest = other.filename(addr), self.filename(addr)
             os.makedirs(os.path.split(dest)[0], exist_ok=True)
-            shutil.copyfile(src, dest)
+            copy_file(src, dest)
         elif not self.exists(addr):
             raise VexCorrupt('Missing file {}'.format(other.filename(addr)))
 
@@ -315,15 +461,18 @@ class BlobStore:
 
     def make_copy(self, addr, dest):
         filename = self.filename(addr)
-        shutil.copyfile(filename, dest)
+        copy_file(filename, dest)
 
     def addr_for_file(self, file):
         hash = self.hashlib()
-        with open(file,'rb') as fh:
-            buf = fh.read(4096)
-            while buf:
-                hash.update(buf)
-                buf = fh.read(4096)
+        with open(file,'rb', buffering=0) as fh:
+            size = os.fstat(fh.fileno()).st_size
+            buf = bytearray(max(1, min(size, HASH_CHUNK_SIZE)))
+            view = memoryview(buf)
+            n = fh.readinto(buf)
+            while n:
+                hash.update(view[:n])
+                n = fh.readinto(buf)
         return self.prefixed_addr(hash)
 
 
@@ -349,7 +498,7 @@ class BlobStore:
         if not self.exists(addr):
             filename = self.filename(addr)
             os.makedirs(os.path.split(filename)[0], exist_ok=True)
-            shutil.copyfile(file, filename)
+            copy_file(file, filename)
         return addr
 
     def put_buf(self, buf, addr=None):
@@ -411,6 +560,9 @@ class Repo:
     def put_scratch_file(self, value, addr=None):
         return self.scratch.put_file(value, addr)
 
+    def put_scratch_buf(self, buf):
+        return self.scratch.put_buf(buf)
+
     def put_scratch_commit(self, value):
         return self.scratch.put_obj(value)
 
@@ -426,6 +578,16 @@ class Repo:
     def add_file_from_scratch(self, addr):
         self.files.copy_from(self.scratch, addr)
 
+    # batch versions, pass executor.map to spread the copies over threads
+    def add_commits_from_scratch(self, addrs, map=map):
+        list(map(self.add_commit_from_scratch, addrs))
+
+    def add_manifests_from_scratch(self, addrs, map=map):
+        list(map(self.add_manifest_from_scratch, addrs))
+
+    def add_files_from_scratch(self, addrs, map=map):
+        list(map(self.add_file_from_scratch, addrs))
+
     def get_file_path(self, addr):
         # diff
         return self.files.filename(addr)
@@ -523,6 +685,11 @@ class GitRepo:
         o = p.stdout.strip()
         return "git:{}".format(o)
 
+    def put_scratch_buf(self, buf):
+        p = subprocess.run(['git', 'hash-object', '-w','-t', 'blob', '--stdin'], input=buf, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env)
+        o = p.stdout.decode('utf-8').strip()
+        return "git:{}".format(o)
+
     def put_scratch_commit(self, value):
         out = self.codec.dump_git_inline(value)
         if out: return out
@@ -560,6 +727,15 @@ class GitRepo:
     def add_file_from_scratch(self, addr):
         return
 
+    def add_commits_from_scratch(self, addrs, map=map):
+        return
+
+    def add_manifests_from_scratch(self, addrs, map=map):
+        return
+
+    def add_files_from_scratch(self, addrs, map=map):
+        return
+
     def copy_from_scratch(self, addr, path):
         return self.copy_from_any(addr, path)
 
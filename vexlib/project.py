@@ -27,6 +27,8 @@ import os
 import sys
 import time
 import os.path
+import bisect
+import collections
 import unicodedata
 import concurrent.futures
 import pickle
@@ -37,14 +39,22 @@ from stat import S_ISREG, S_ISDIR
 
 from . import rson
 from .errors import *
-from .fs import UUID, FileStore, BlobStore, file_diff, match_filename, list_dir, Repo, GitRepo, LockFile, HistoryStore
+from .fs import UUID, FileStore, StatCache, BlobStore, file_diff, match_filename, list_dir, Repo, GitRepo, LockFile, HistoryStore
 
 def NOW(): return datetime.now(timezone.utc)
 
+if hasattr(time, 'time_ns'):
+    time_ns = time.time_ns
+else:
+    def time_ns(): return int(time.time() * 1000000000)
+
 # If you check a last modified time, it should be reasonably in the past
 # if too close to current time, may miss any current modificatons
 
 MTIME_GRACE_SECONDS = 0.5 # But on FAT32, this should be > 3 seconds, and on nanotimes, 1^-9
+MTIME_GRACE_NS = int(MTIME_GRACE_SECONDS * 1000000000)
+BLOB_CACHE_SIZE = 1024 # manifests/commits kept per transaction
+LISTING_CACHE_SIZE = 4 # file listings of root manifests kept per project
 
 class Codec:
     def __init__(self):
@@ -64,10 +74,11 @@ class Codec:
         return cls
     def to_tag(self, obj):
         name = obj.__class__.__name__
+        attrs = obj.__getstate__() if hasattr(obj, '__slots__') else obj.__dict__
         if name in self.literals:
-            return name, next(iter(obj.__dict__.values()))
+            return name, next(iter(attrs.values()))
         if name not in self.classes: raise VexBug('An {} object cannot be turned into RSON'.format(name))
-        return name, {k:v for k,v in obj.__dict__.items() if not k.startswith('_')}
+        return name, {k:v for k,v in attrs.items() if not k.startswith('_')}
     def from_tag(self, tag, value):
         if tag in self.literals:
             return self.literals[tag](value)
@@ -78,8 +89,10 @@ class Codec:
         return self.codec.parse(buf.decode('utf-8'))
 
 class PickleCodec:
+    # pin protocol 4 so 3.6/3.7 (default 3) get framing, newer interpreters default to it anyway
+    PROTOCOL = min(4, pickle.HIGHEST_PROTOCOL)
     def dump(self, obj):
-        return pickle.dumps(obj)
+        return pickle.dumps(obj, protocol=self.PROTOCOL)
     def parse(self, buf):
         return pickle.loads(buf)
 
@@ -92,10 +105,21 @@ class GitCodec:
     GIT_LINK_MODE = 0o120_000
     GIT_GITLINK_MODE = 0o160_000 # actually a submodule, blegh
 
+    TIMEZONES = {'+0000': timezone.utc, '-0000': timezone.utc} # shared across commits, offsets repeat a lot
+
     def __init__(self, project, codec):
         self.codec = codec
         self.project = project
 
+    def git_timezone(self, offset):
+        tz = self.TIMEZONES.get(offset)
+        if tz is None:
+            hours, minutes = int(offset[1:-2]), int(offset[-2:])
+            delta = timedelta(hours=hours, minutes=minutes)
+            tz = timezone(-delta if offset[0] == '-' else delta)
+            self.TIMEZONES[offset] = tz
+        return tz
+
     def parse_git_commit(self, buf):
         headers = {}
         buf =  buf.decode('utf-8')
@@ -118,7 +142,7 @@ class GitCodec:
             timestamp = rson.parse_datetime(timestamp)
         else:
             _, timestamp, offset = headers['committer'].rsplit(' ',2)
-            timestamp = datetime(1970,1,1) + timedelta(seconds=int(timestamp)) + timedelta(hours=int(offset[:-2]))
+            timestamp = datetime.fromtimestamp(int(timestamp), tz=self.git_timezone(offset))
         previous = "git:{}".format(headers['parent']) if 'parent' in headers else None
         ancestors = {}
         for name, value in headers.items():
@@ -185,8 +209,8 @@ class GitCodec:
             pos = zr+21
 
         new_entries = {}
-        for name, entry in entries.items():
-            mode, addr = entry
+        for name in sorted(entries): # git orders subtrees as 'name/', manifests are plain sorted
+            mode, addr = entries[name]
             if addr == self.EMPTY_GIT_TREE:
                 addr = None
             else:
@@ -315,18 +339,16 @@ class objects:
             self.message = message
             self.entries = entries
 
+        # entries may be tuples (see active_changeset), so build new lists rather than mutate
         def append_changes(self, changeset):
             for name, changes in changeset.items():
-                if name not in self.entries:
-                    self.entries[name] = []
-                self.entries[name].extend(changes)
+                old = self.entries.get(name)
+                self.entries[name] = list(old) + list(changes) if old else list(changes)
 
         def prepend_changes(self, changeset):
             for name, changes in changeset.items():
-                if name not in self.entries:
-                    self.entries[name] = []
-                for change in changes:
-                    self.entries[name].insert(0, change)
+                old = self.entries.get(name)
+                self.entries[name] = list(changes) + list(old) if old else list(changes)
 
         def items(self):
             return self.entries.items()
@@ -414,7 +436,7 @@ class objects:
 
     @codec.register
     class Switch:
-        def __init__(self, time, command, prefix, active, session_states, branch_states, names, states):
+        def __init__(self, time, command, prefix, active, session_states, branch_states, names, states, changes=None):
             self.time = time
             self.command = command
             self.prefix = prefix
@@ -423,6 +445,9 @@ class objects:
             self.branch_states = branch_states 
             self.names = names
             self.states = states
+            # branches and sessions created for the switch, written like a
+            # do_without_undo entry: undo and redo leave them alone
+            self.changes = changes
 
     # Working copy state
 
@@ -440,7 +465,17 @@ class objects:
             self.base = base
             self.init = init
             self.upstream = upstream
-            self.sessions = sessions
+            # an ordered set of session uuids, stored as a list
+            self.sessions = collections.OrderedDict.fromkeys(sessions)
+
+        def __getstate__(self):
+            state = dict(self.__dict__)
+            state['sessions'] = list(self.sessions)
+            return state
+
+        def __setstate__(self, state):
+            self.__dict__.update(state)
+            self.sessions = collections.OrderedDict.fromkeys(state['sessions'])
 
     @codec.register
     class Session:
@@ -468,9 +503,22 @@ class objects:
             self.files.update(added)
             return True
 
+        # the path cache is per process, don't write it out with the session
+        def __getstate__(self):
+            return {k: v for k, v in self.__dict__.items() if k != '_paths'}
+
         def repo_to_full_path(self, project, file):
+            paths = self.__dict__.get('_paths')
+            if paths is None or paths[0] != (project.working_dir, self.prefix):
+                paths = self._paths = ((project.working_dir, self.prefix), {})
+            full = paths[1].get(file)
+            if full is None:
+                full = paths[1][file] = self._repo_to_full_path(project, file)
+            return full
+
+        def _repo_to_full_path(self, project, file):
             file = os.path.normpath(file)
-            if os.path.commonpath((file, project.VEX)) == project.VEX:
+            if _inside(file, project.VEX):
                 path = os.path.relpath(file, project.VEX)
                 return os.path.normpath(os.path.join(project.settings.dir, path))
             else:
@@ -481,7 +529,7 @@ class objects:
             file = os.path.normpath(file)
             file = unicodedata.normalize('NFC', file)
 
-            if os.path.commonpath((project.settings.dir, file)) == project.settings.dir:
+            if _inside(file, project.settings.dir):
                 path = os.path.relpath(file, project.settings.dir)
                 return os.path.normpath(os.path.join(project.VEX, path))
             else:
@@ -512,11 +560,14 @@ class objects:
         Unchanged = set(('tracked'))
         Changed = set(('added', 'modified', 'deleted', 'replaced'))
 
+        # sessions hold one of these per file, so skip the per instance dict
+        __slots__ = ('kind', 'state', 'working', 'addr', 'mtime', 'size', 'mode', 'stash', 'properties', 'replace')
+
         def __init__(self, kind, state, *, working=False, addr=None, stash=None, size=None, mode=None, mtime=None, properties=None, replace=None):
             if kind not in self.Kinds: raise VexBug('bad')
             if state not in self.States: raise VexBug('bad')
-            self.kind = kind
-            self.state = state
+            self.kind = sys.intern(kind)
+            self.state = sys.intern(state)
             self.working = working
             self.addr = addr
             self.mtime = mtime
@@ -526,6 +577,18 @@ class objects:
             self.properties = properties
             self.replace = replace
 
+        # pickled as a plain dict, same as before __slots__, so old sessions still load
+        def __getstate__(self):
+            return {k: getattr(self, k) for k in self.__slots__}
+
+        def __setstate__(self, state):
+            if isinstance(state, tuple):
+                state = state[1]
+            for k in self.__slots__:
+                setattr(self, k, state.get(k))
+            self.kind = sys.intern(self.kind)
+            self.state = sys.intern(self.state)
+
         def set_property(self, name, value):
             self.properties[name] = value
             if self.state == 'tracked':
@@ -539,6 +602,24 @@ class objects:
             try:
                 st = os.stat(path)
             except FileNotFoundError:
+                st = None
+            self.refresh_with_stat(path, st, addr_for_file)
+
+        def needs_hash(self, st):
+            if self.kind != 'file' or self.state != 'tracked' or not self.working:
+                return False
+            if st is None or S_ISDIR(st.st_mode):
+                return False
+            if self.mtime is None or self.size is None or self.mode is None:
+                return True
+            return False
+
+        def refresh_with_stat(self, path, st, addr_for_file):
+            if self.kind == 'ignore' or self.kind == 'gitfile' or not self.working:
+                return
+            if self.state == 'deleted':
+                return
+            if st is None:
                 self.state = "deleted"
                 self.kind = self.replace or self.kind
                 self.addr, self.properties = None, None
@@ -612,6 +693,86 @@ class objects:
                 pass
             elif self.kind == "gitfile":
                 pass
+
+
+def _merge_sorted(a, b):
+    """ merge two sorted lists of names, dropping duplicates """
+    out = []
+    i, j = 0, 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            out.append(a[i])
+            i += 1
+        elif b[j] < a[i]:
+            out.append(b[j])
+            j += 1
+        else:
+            out.append(a[i])
+            i += 1
+            j += 1
+    out.extend(a[i:])
+    out.extend(b[j:])
+    return out
+
+def _inside(path, dir):
+    """ os.path.commonpath((path, dir)) == dir, for paths that are already normalised """
+    return path == dir or path.startswith(dir) and (dir.endswith('/') or path[len(dir)] == '/')
+
+def _path_key(path):
+    """ sort key putting a directory before everything inside it """
+    return path.split('/')
+
+def _deepest_first(path):
+    """ sort key for removing directories, children before their parents """
+    return (-path.count('/'), path)
+
+def _repo_join(prefix, name):
+    """ repo paths are always / separated, unlike os.path.join """
+    if prefix.endswith('/'):
+        return prefix + name
+    return prefix + '/' + name
+
+# (kind, state) of a changed Tracked entry to the change that records it,
+# deletions depend on what was replaced so active_changeset handles those
+_ACTIVE_CHANGES = {
+    ('file', 'added'): objects.AddFile,
+    ('file', 'replaced'): objects.NewFile,
+    ('file', 'modified'): objects.ChangeFile,
+    ('dir', 'added'): objects.AddDir,
+    ('dir', 'replaced'): objects.NewDir,
+    ('dir', 'modified'): objects.ChangeDir,
+}
+
+# states of a working file whose contents aren't in the repo yet
+_STASH_STATES = frozenset(('added', 'replaced', 'modified'))
+
+def _bulk_stat(paths):
+    """ stat paths one directory at a time, anything not found is left out """
+    by_dir = collections.defaultdict(set)
+    for path in paths:
+        by_dir[os.path.dirname(path)].add(path)
+    out = {}
+    for dir, children in by_dir.items():
+        try:
+            with os.scandir(dir) as it:
+                for dir_entry in it:
+                    if dir_entry.path in children:
+                        try:
+                            out[dir_entry.path] = dir_entry.stat()
+                        except FileNotFoundError:
+                            pass
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+    return out
+
+def _names_under(sorted_names, name):
+    """ names inside directory name, from a sorted list of names """
+    prefix = "{}/".format(name)
+    i = bisect.bisect_left(sorted_names, prefix)
+    while i < len(sorted_names) and sorted_names[i].startswith(prefix):
+        yield sorted_names[i]
+        i += 1
+
 class History:
     START = 'init'
     Modes = set(('init', 'do', 'undo', 'redo', 'quiet'))
@@ -631,10 +792,10 @@ class History:
             if self.store.current():
                 return self.store.current() == self.store.next()[1]
 
-    def entries(self):
+    def entries(self, limit=None):
         current = self.store.current()
         out = []
-        while current != self.START:
+        while current != self.START and (limit is None or len(out) < limit):
             prev, obj = self.store.get_entry(current)
             redos = [self.store.get_entry(x)[1] for x in self.store.get_redos(current)]
             out.append((obj, redos))
@@ -650,8 +811,9 @@ class History:
             yield action
             return
         current = self.store.current()
-        addr = self.store.put_entry(current, action)
-        self.store.set_next('quiet', addr , current)
+        with self.store.batch():
+            addr = self.store.put_entry(current, action)
+            self.store.set_next('quiet', addr , current)
 
         yield action
 
@@ -666,8 +828,9 @@ class History:
             return
         current = self.store.current()
 
-        addr = self.store.put_entry(current, obj)
-        self.store.set_next('do', addr,current)
+        with self.store.batch():
+            addr = self.store.put_entry(current, obj)
+            self.store.set_next('do', addr,current)
 
         yield obj
 
@@ -694,8 +857,9 @@ class History:
 
         yield obj
 
-        self.store.set_redos(prev, redos)
-        self.store.set_current(prev)
+        with self.store.batch():
+            self.store.set_redos(prev, redos)
+            self.store.set_current(prev)
 
     @contextmanager
     def redo(self, n, fake):
@@ -720,8 +884,9 @@ class History:
 
         yield obj
 
-        self.store.set_redos(current, redos)
-        self.store.set_current(do)
+        with self.store.batch():
+            self.store.set_redos(current, redos)
+            self.store.set_current(do)
 
     @contextmanager
     def rollback_new(self):
@@ -762,10 +927,12 @@ class History:
             self.store.set_current(['restart', next, None])
 
 
-    def redo_choices(self):
+    def redo_choices(self, limit=None):
         current = self.store.current()
 
         redos = self.store.get_redos(current)
+        if limit is not None:
+            redos = redos[:limit]
 
         out = []
         for do in redos:
@@ -797,6 +964,12 @@ class SessionTransaction:
         self.old_working = {}
         self.old_states = {}
         self.new_states = {}
+        # blobs are content addressed, so a read can be reused for the whole transaction
+        self._manifest_cache = collections.OrderedDict()
+        self._commit_cache = collections.OrderedDict()
+        # branches and sessions read but not yet put, so a second get hands back the same object
+        self._branch_cache = {}
+        self._session_cache = {}
 
     def cancel(self):
         raise Cancel()
@@ -821,20 +994,43 @@ class SessionTransaction:
         self.new_files.add(addr)
         return addr
 
+    def _cached(self, cache, addr, fetch):
+        if addr in cache:
+            cache.move_to_end(addr)
+            return cache[addr]
+        value = fetch(addr)
+        cache[addr] = value
+        if len(cache) > BLOB_CACHE_SIZE:
+            cache.popitem(last=False)
+        return value
+
     def get_manifest(self, addr):
         if addr in self.new_manifests:
-            return self.project.get_scratch_manifest(addr)
-        return self.project.get_manifest(addr)
+            return self._cached(self._manifest_cache, addr, self.project.get_scratch_manifest)
+        return self._cached(self._manifest_cache, addr, self.project.get_manifest)
+
+    def get_manifests(self, addrs):
+        """ get_manifest for each addr, reading the uncached ones side by side """
+        addrs = list(addrs)
+        missing = [addr for addr in set(addrs) if addr not in self._manifest_cache]
+        def fetch(addr):
+            if addr in self.new_manifests:
+                return self.project.get_scratch_manifest(addr)
+            return self.project.get_manifest(addr)
+        # the cache is only touched from this thread
+        found = dict(zip(missing, self.project.io_pool().map(fetch, missing)))
+        return [self._cached(self._manifest_cache, addr, lambda addr: found[addr] if addr in found else fetch(addr)) for addr in addrs]
 
     def put_manifest(self, obj):
         addr = self.project.put_scratch_manifest(obj)
         self.new_manifests.add(addr)
+        self._manifest_cache.pop(addr, None)
         return addr
 
     def get_commit(self, addr):
         if addr in self.new_commits:
-            return self.project.get_scratch_commit(addr)
-        return self.project.get_commit(addr)
+            return self._cached(self._commit_cache, addr, self.project.get_scratch_commit)
+        return self._cached(self._commit_cache, addr, self.project.get_commit)
 
     def put_commit(self, obj):
         addr = self.project.put_scratch_commit(obj)
@@ -844,7 +1040,16 @@ class SessionTransaction:
     def get_session(self, uuid):
         if uuid in self.new_sessions:
             return self.new_sessions[uuid]
-        return self.project.sessions.get(uuid)
+        if uuid not in self._session_cache:
+            self._session_cache[uuid] = self.project.sessions.get(uuid)
+        return self._session_cache[uuid]
+
+    def get_sessions(self, uuids):
+        """ uuid -> session, in the order given """
+        uuids = list(uuids)
+        missing = [uuid for uuid in uuids if uuid not in self.new_sessions and uuid not in self._session_cache]
+        self._session_cache.update(self.project.get_sessions(missing))
+        return collections.OrderedDict((uuid, self.get_session(uuid)) for uuid in uuids)
 
     def put_session(self, session):
         if session.uuid not in self.old_sessions:
@@ -857,8 +1062,9 @@ class SessionTransaction:
     def get_branch(self, uuid):
         if uuid in self.new_branches:
             return self.new_branches[uuid]
-
-        return self.project.branches.get(uuid)
+        if uuid not in self._branch_cache:
+            self._branch_cache[uuid] = self.project.branches.get(uuid)
+        return self._branch_cache[uuid]
 
     def put_branch(self, branch):
         if branch.uuid not in self.old_branches:
@@ -869,6 +1075,12 @@ class SessionTransaction:
 
         self.new_branches[branch.uuid] = branch
 
+    def put_branches(self, branches):
+        """ put_branch for each, looking up the stored copies side by side """
+        missing = [branch.uuid for branch in branches if branch.uuid not in self.old_branches]
+        self.old_branches.update(self.project.branches.get_many(missing, map=self.project.io_pool().map))
+        self.new_branches.update((branch.uuid, branch) for branch in branches)
+
     def get_branch_uuid(self, name):
         if name in self.new_names:
             return self.new_names[names]
@@ -883,6 +1095,12 @@ class SessionTransaction:
                 self.old_names[name] = None
         self.new_names[name] = branch
 
+    def set_branch_uuids(self, names):
+        """ set_branch_uuid for each name -> branch uuid """
+        missing = [name for name in names if name not in self.old_names]
+        self.old_names.update(self.project.names.get_many(missing, map=self.project.io_pool().map))
+        self.new_names.update(names)
+
     def set_state(self, name, value):
         if name not in self.old_states:
             if self.project.state.exists(name):
@@ -904,6 +1122,13 @@ class SessionTransaction:
                 self.old_settings[name] = None
         self.new_settings[name] = value
 
+    def stage_setting(self, name, value):
+        """ set_setting, and put what the settings file will hold in scratch, returning its addr """
+        self.set_setting(name, value)
+        addr = self.project.put_scratch_buf(self.project.settings.dump(name, value))
+        self.new_files.add(addr)
+        return addr
+
     def get_setting(self, name):
         if name in self.new_settings:
             return self.new_settings[name]
@@ -923,7 +1148,7 @@ class SessionTransaction:
         b = self.get_branch(branch_uuid)
         files = self.build_files(commit)
         session = objects.Session(session_uuid, branch_uuid, state, b.prefix, commit, commit, files, message="", activity=None)
-        b.sessions.append(session.uuid)
+        b.sessions[session.uuid] = None
         self.put_branch(b)
         self.put_session(session)
         return session
@@ -955,12 +1180,29 @@ class SessionTransaction:
     def refresh_active(self, active=None):
         if active is None:
             active = self.active()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            for name, entry in active.files.items():
-                if not entry.working or entry.state =='deleted':
-                    continue
-                path = active.repo_to_full_path(self.project, name)
-                executor.submit(entry.refresh,path, self.project.addr_for_file)
+        work = []
+        for name, entry in active.files.items():
+            if not entry.working or entry.state =='deleted':
+                continue
+            path = active.repo_to_full_path(self.project, name)
+            work.append((path, entry))
+        stats = _bulk_stat(path for path, entry in work)
+        executor = self.project.io_pool()
+        futures = []
+        for path, entry in work:
+            if path in stats:
+                # only hashing is worth a thread, the rest is comparing stat fields
+                st = stats[path]
+                if entry.needs_hash(st):
+                    futures.append(executor.submit(entry.refresh_with_stat, path, st, self.project.addr_for_file))
+                else:
+                    entry.refresh_with_stat(path, st, self.project.addr_for_file)
+            else:
+                futures.append(executor.submit(entry.refresh, path, self.project.addr_for_file))
+        concurrent.futures.wait(futures)
+        for future in futures:
+            # raise any failure rather than save a half refreshed session
+            future.result()
         self.put_session(active)
         return active
 
@@ -985,61 +1227,45 @@ class SessionTransaction:
                 old = file
                 while old != '/':
                     files_to_check.add(old)
-                    old = os.path.split(old)[0]
+                    old = old.rpartition('/')[0] or '/'
 
+        files = active.files
+        repo_to_full_path = active.repo_to_full_path
+        addr_for_file = self.addr_for_file
+        project = self.project
         for repo_name in files_to_check:
-            entry = active.files[repo_name]
+            entry = files[repo_name]
             # and stashed items...? eh nm
+            state = entry.state
+            if state == 'tracked':
+                if entry.kind not in objects.Tracked.Kinds:
+                    raise VexBug('kind')
+                continue
 
-            if entry.kind == 'file':
-                if entry.state == "added":
-                    filename = active.repo_to_full_path(self.project, repo_name)
-                    addr = self.addr_for_file(filename)
-                    out[repo_name]=objects.AddFile(addr, properties=entry.properties)
-                elif entry.state == "replaced":
-                    filename = active.repo_to_full_path(self.project, repo_name)
-                    addr = self.addr_for_file(filename)
-                    out[repo_name]=objects.NewFile(addr, properties=entry.properties)
-                elif entry.state == "modified":
-                    filename = active.repo_to_full_path(self.project, repo_name)
-                    addr = self.addr_for_file(filename)
-                    out[repo_name]=objects.ChangeFile(addr, properties=entry.properties)
-                elif entry.state == "deleted":
-                    if entry.replace == "dir":
-                        out[repo_name]=objects.DeleteDir()
-                    else:
-                        out[repo_name]=objects.DeleteFile()
-                elif entry.state == 'tracked':
-                    pass
+            change = _ACTIVE_CHANGES.get((entry.kind, state))
+            if change is not None:
+                if entry.kind == 'file':
+                    addr = addr_for_file(repo_to_full_path(project, repo_name))
+                    out[repo_name] = change(addr, properties=entry.properties)
                 else:
-                    raise VexBug('state {}'.format(entry.state))
-            elif entry.kind =='dir':
-                if entry.state == "added":
-                    out[repo_name]=objects.AddDir(properties=entry.properties)
-                elif entry.state == "replaced":
-                    out[repo_name]=objects.NewDir(properties=entry.properties)
-                elif entry.state == "modified":
-                    out[repo_name]=objects.ChangeDir(properties=entry.properties)
-                elif entry.state == "deleted":
-                    if entry.replace == "file":
-                        out[repo_name]=objects.DeleteFile()
-                    else:
-                        out[repo_name]=objects.DeleteDir()
-                elif entry.state == 'tracked':
-                    pass
+                    out[repo_name] = change(properties=entry.properties)
+            elif state == "deleted" and entry.kind in ('file', 'dir'):
+                if (entry.replace or entry.kind) == "dir":
+                    out[repo_name]=objects.DeleteDir()
                 else:
-                    raise VexBug('state {}'.format(entry.state))
-            elif entry.kind == 'ignore':
-                pass
-            elif entry.kind == 'gitfile':
+                    out[repo_name]=objects.DeleteFile()
+            elif entry.kind == 'ignore' or entry.kind == 'gitfile':
                 pass
-            else:
+            elif entry.kind not in objects.Tracked.Kinds:
                 raise VexBug('kind')
+            else:
+                raise VexBug('state {}'.format(state))
 
-        return objects.Changeset({k:[v] for k,v in out.items()})
+        return objects.Changeset({k:(v,) for k,v in out.items()})
 
     def update_active_from_changeset(self, changeset):
         active = self.active()
+        now_ns = time_ns()
         for name, changes in changeset.items():
             entry = active.files.get(name)
             change = changes[-1]
@@ -1060,7 +1286,7 @@ class SessionTransaction:
                 if entry.working:
                     path = active.repo_to_full_path(self.project, name)
                     stat = os.stat(path)
-                    if (time.time() - stat.st_mtime) < MTIME_GRACE_SECONDS:
+                    if (now_ns - stat.st_mtime_ns) < MTIME_GRACE_NS:
                         mtime = None
                     else:
                         mtime = stat.st_mtime
@@ -1084,6 +1310,7 @@ class SessionTransaction:
 
     def store_changeset_files(self, changeset):
         active = self.active()
+        to_store = []
         for name, changes in changeset.items():
             change = changes[-1]
             entry = active.files.get(name)
@@ -1095,23 +1322,31 @@ class SessionTransaction:
                 if entry.working:
                     filename = active.repo_to_full_path(self.project, name)
                     if os.path.isfile(filename) and isinstance(change, (objects.AddFile, objects.ChangeFile, objects.NewFile)):
-                        addr = self.put_file(filename)
-                        if addr != change.addr:
-                            raise VexCorrupt('Sync')
+                        to_store.append((filename, change.addr))
                 elif entry.stash:
                     self.new_files.add(entry.stash)
                 else:
                     raise VexBug('sync')
 
+        filenames = [filename for filename, addr in to_store]
+        for (filename, expected), addr in zip(to_store, self.project.io_pool().map(self.put_file, filenames)):
+            if addr != expected:
+                raise VexCorrupt('Sync')
+
 
     def new_root_with_changeset(self, old, changeset):
         dir_changes = {}
-        for path, entry in sorted((p.split('/'),e) for p,e in changeset.items()):
-            prefix, name = "/".join(path[:-1]), path[-1]
+        touched = set(('/',)) # every directory with a change somewhere beneath it
+        for path, entry in changeset.items():
+            prefix, _, name = path.rpartition('/')
             prefix = prefix or "/"
             name = name or "."
             if prefix not in dir_changes:
                 dir_changes[prefix]  = {}
+                parent = prefix
+                while parent not in touched:
+                    touched.add(parent)
+                    parent = parent.rpartition('/')[0] or "/"
             dir_changes[prefix][name] = entry
 
         def apply_changes(prefix, addr, root=False):
@@ -1120,17 +1355,18 @@ class SessionTransaction:
             changes = dir_changes.get(prefix, None)
             changed = bool(changes)
             properties = {}
-            names = set()
             if addr:
                 old = self.get_manifest(addr)
                 if root:
                     properties = getattr(old, 'properties', {})
                 old_entries = old.entries
-                names.update(old_entries.keys())
+            # manifest entries are stored sorted, so only the changes need sorting
             if changes:
-                names.update(changes.keys())
+                names = _merge_sorted(list(old_entries), sorted(changes))
+            else:
+                names = old_entries.keys()
 
-            for name in sorted(names):
+            for name in names:
                 if name == ".":
                     if not root: raise VexBug('...')
                     for change in changes.pop(name):
@@ -1176,7 +1412,10 @@ class SessionTransaction:
                             raise VexBug('nope', change)
                         
                 if entry and isinstance(entry, objects.Dir):
-                    path = os.path.join(prefix, name)
+                    path = _repo_join(prefix, name)
+                    if path not in touched:
+                        entries[name] = entry
+                        continue
                     new_addr = apply_changes(path, entry.addr)
                     if new_addr != entry.addr:
                         changed = True
@@ -1191,7 +1430,6 @@ class SessionTransaction:
             if not entries:
                 return None
             elif changed:
-                entries = {k:entries[k] for k in sorted(entries)}
                 if root:
                     return self.put_manifest(objects.Root(entries, properties))
                 else:
@@ -1204,22 +1442,43 @@ class SessionTransaction:
     def build_files(self, commit):
         output = {}
 
-        def walk(prefix, addr, root=False):
-            old = self.get_manifest(addr)
+        def fetch_tree(root):
+            # read a whole layer of directories at once, sibling manifests don't depend on each other
+            manifests = {}
+            layer = [root]
+            while layer:
+                next_layer = set()
+                for addr, manifest in zip(layer, self.get_manifests(layer)):
+                    manifests[addr] = manifest
+                    for entry in manifest.entries.values():
+                        if isinstance(entry, objects.Dir) and entry.addr and entry.addr not in manifests:
+                            next_layer.add(entry.addr)
+                layer = [addr for addr in next_layer if addr not in manifests]
+            return manifests
+
+        def walk(listing, prefix, addr, root=False):
+            manifests = fetch_tree(addr)
+            old = manifests[addr]
             if root:
-                output[prefix] = objects.Tracked('dir', 'tracked', properties=getattr(old, 'properties', {}))
-            for name, entry in old.entries.items():
-                path = os.path.join(prefix, name)
-                if isinstance(entry, objects.Dir):
-                    output[path] = objects.Tracked('dir', 'tracked', properties=entry.properties)
-                    if entry.addr:
-                        walk(path, entry.addr)
-                elif isinstance(entry, objects.File):
-                    output[path] = objects.Tracked('file', 'tracked', addr=entry.addr, properties=entry.properties)
-                elif isinstance(entry, objects.Ignored):
-                    output[path] = objects.Tracked('ignore', 'tracked', properties={})
-                elif isinstance(entry, objects.GitFile):
-                    output[path] = objects.Tracked('gitfile', 'tracked', addr=entry.addr, properties=entry.properties)
+                listing.append((prefix, 'dir', None, getattr(old, 'properties', {})))
+            stack = [(prefix, iter(old.entries.items()))]
+            while stack:
+                prefix, entries = stack[-1]
+                for name, entry in entries:
+                    path = _repo_join(prefix, name)
+                    if isinstance(entry, objects.Dir):
+                        listing.append((path, 'dir', None, entry.properties))
+                        if entry.addr:
+                            stack.append((path, iter(manifests[entry.addr].entries.items())))
+                            break
+                    elif isinstance(entry, objects.File):
+                        listing.append((path, 'file', entry.addr, entry.properties))
+                    elif isinstance(entry, objects.Ignored):
+                        listing.append((path, 'ignore', None, {}))
+                    elif isinstance(entry, objects.GitFile):
+                        listing.append((path, 'gitfile', entry.addr, entry.properties))
+                else:
+                    stack.pop()
 
         def extract(changes):
             for path, changes in changes.items():
@@ -1237,7 +1496,20 @@ class SessionTransaction:
 
         old_uuid, old, changes = self.prepared_changeset(commit)
         if old.root is not None:
-            walk('/', old.root, root=True)
+            # the walk only depends on the root addr, but Tracked entries get
+            # modified by callers, so cache the listing and build fresh ones
+            cache = self.project._listing_cache
+            listing = cache.get(old.root)
+            if listing is None:
+                listing = []
+                walk(listing, '/', old.root, root=True)
+                cache[old.root] = listing
+                if len(cache) > LISTING_CACHE_SIZE:
+                    cache.popitem(last=False)
+            else:
+                cache.move_to_end(old.root)
+            for path, kind, addr, properties in listing:
+                output[path] = objects.Tracked(kind, 'tracked', addr=addr, properties=dict(properties) if properties is not None else None)
         else:
             output['/'] = objects.Tracked("dir", "tracked", properties={})
 
@@ -1251,9 +1523,12 @@ class SessionTransaction:
         to_scan = set()
         names = {}
         dirs = {}
+        seen_parents = set()
+        get_entry = active.files.get
+        config_dir = self.project.config_dir
         for filename in files:
             name = active.full_to_repo_path(self.project, filename)
-            entry = active.files.get(name)
+            entry = get_entry(name)
             if os.path.isfile(filename):
                 if not entry or entry.kind != 'file': 
                     names[name] = filename
@@ -1261,24 +1536,28 @@ class SessionTransaction:
                 if not entry or entry.kind != 'dir': 
                     dirs[name] = filename
                 to_scan.add(filename)
-            filename = os.path.split(filename)[0]
-            name = os.path.split(name)[0]
-            while name != '/' and filename != self.project.config_dir:
-                entry = active.files.get(name)
+            filename = filename.rpartition('/')[0] or '/'
+            name = name.rpartition('/')[0] or '/'
+            while name != '/' and filename != config_dir:
+                if name in seen_parents:
+                    break
+                seen_parents.add(name)
+                entry = get_entry(name)
                 if entry and entry.kind != 'dir': 
                     break
                 dirs[name] = filename
-                name = os.path.split(name)[0]
-                filename = os.path.split(filename)[0]
+                name = name.rpartition('/')[0] or '/'
+                filename = filename.rpartition('/')[0] or '/'
 
         for dir in to_scan:
-            for filename in list_dir(dir, ignore, include): # recursive
+            for dir_entry in list_dir(dir, ignore, include): # recursive
+                filename = dir_entry.path
                 name = active.full_to_repo_path(self.project, filename)
-                entry = active.files.get(name)
-                if os.path.isfile(filename):
+                entry = get_entry(name)
+                if dir_entry.is_file():
                     if not entry or entry.kind != 'file': 
                         names[name] = filename
-                elif os.path.isdir(filename):
+                elif dir_entry.is_dir():
                     if not entry or entry.kind != 'dir': 
                         dirs[name] = filename
         return dirs, names
@@ -1322,6 +1601,7 @@ class SessionTransaction:
         names = {}
         dirs = []
         changed = {}
+        sorted_names = None
         for filename in files:
             name = session.full_to_repo_path(self.project, filename)
             if name in session.files:
@@ -1330,11 +1610,11 @@ class SessionTransaction:
                 if entry.working:
                     names[name] = entry
                     if entry.kind == 'dir':
-                        p = "{}/".format(name)
-                        for e in session.files:
-                            if e.startswith(p):
-                                names[e] = session.files[e]
-                                changed[e] = session.repo_to_full_path(self.project, e)
+                        if sorted_names is None:
+                            sorted_names = sorted(session.files)
+                        for e in _names_under(sorted_names, name):
+                            names[e] = session.files[e]
+                            changed[e] = session.repo_to_full_path(self.project, e)
         new_files = {}
         gone_files = set()
 
@@ -1350,7 +1630,7 @@ class SessionTransaction:
     
     def remove_files_from_active(self, files):
         changed = self.forget_files_from_active(files)
-        for path in sorted(changed, reverse=True, key= lambda x:x.split("/")):
+        for path in sorted(changed, reverse=True, key=_path_key):
             file = changed[path]
             if os.path.isfile(file):
                 addr = self.project.put_scratch_file(file)
@@ -1365,14 +1645,18 @@ class SessionTransaction:
         active = self.active()
         
         old_files = self.build_files(active.prepare)
+        sorted_names = sorted(old_files)
         new_files = {}
         changed = {}
         paths = [active.full_to_repo_path(self.project, file) for file in files]
+        seen = set()
         
         while paths:
             path = paths.pop()
-            if path not in old_files:
+            # a directory queues everything beneath it, including its subdirectories' contents
+            if path not in old_files or path in seen:
                 continue
+            seen.add(path)
             entry = old_files[path]
             file = active.repo_to_full_path(self.project, path)
             if entry.kind == 'file': 
@@ -1386,10 +1670,7 @@ class SessionTransaction:
                     self.old_working[path] = None
                     self.new_working[path] = old_files[path].addr
             elif entry.kind =='dir':
-                p = "{}/".format(path)
-                for name in old_files:
-                    if name.startswith(p):
-                        paths.append(name)
+                paths.extend(_names_under(sorted_names, path))
 
                 if os.path.exists(file):
                     continue
@@ -1411,21 +1692,21 @@ class SessionTransaction:
         return changed
 
     def action(self):
-        if self.new_branches or self.new_names or self.new_sessions or self.new_settings or self.new_states:
-            branches = dict(old=self.old_branches, new=self.new_branches)
-            names = dict(old=self.old_names, new=self.new_names)
-            sessions = dict(old=self.old_sessions, new=self.new_sessions)
-            settings = dict(old=self.old_settings, new=self.new_settings)
-            states = dict(old=self.old_states, new=self.new_states)
-
-            changes = dict(branches=branches,names=names, sessions=sessions, settings=settings, states=states)
-        else:
-            changes = {}
-
-        if self.new_commits or self.new_manifests or self.new_files:
-            blobs = dict(commits=self.new_commits, manifests=self.new_manifests, files=self.new_files)
-        else:
-            blobs = {}
+        # old/new only hold keys that were touched, and untouched stores are left out
+        changes = {}
+        for key, old, new in (
+                ('branches', self.old_branches, self.new_branches),
+                ('names', self.old_names, self.new_names),
+                ('sessions', self.old_sessions, self.new_sessions),
+                ('settings', self.old_settings, self.new_settings),
+                ('states', self.old_states, self.new_states)):
+            if new:
+                changes[key] = dict(old=old, new=new)
+
+        blobs = {}
+        for key, new in (('commits', self.new_commits), ('manifests', self.new_manifests), ('files', self.new_files)):
+            if new:
+                blobs[key] = new
         if self.new_working:
             working = dict(old=self.old_working, new=self.new_working)
         else:
@@ -1433,7 +1714,7 @@ class SessionTransaction:
         return objects.Action(self.now, self.command, changes, blobs, working)
 
 class SwitchTransaction:
-    def __init__(self, project, command):
+    def __init__(self, project, command, setup=None):
         self.project = project
         self.command = command
         self.cancelled = False
@@ -1448,6 +1729,11 @@ class SwitchTransaction:
         self.old_states = {}
         self.new_states = {}
         self.now = NOW()
+        # only .state is read from these, so keep the first read around
+        self._branch_cache = {}
+        self._session_cache = {}
+        # a SessionTransaction whose new branches and sessions are written before the switch
+        self.setup = setup
 
     def switch_prefix(self, new_prefix):
         self.prefix = {'old': self.project.prefix(), 'new': new_prefix}
@@ -1456,20 +1742,34 @@ class SwitchTransaction:
         if isinstance(new_session, objects.Session): raise VexBug()
         self.active_session = {'old': self.project.state.get('active'), 'new': new_session}
 
+    def get_branch(self, uuid):
+        if uuid not in self._branch_cache:
+            if self.setup and uuid in self.setup.new_branches:
+                return self.setup.new_branches[uuid]
+            self._branch_cache[uuid] = self.project.branches.get(uuid)
+        return self._branch_cache[uuid]
+
+    def get_session(self, uuid):
+        if uuid not in self._session_cache:
+            if self.setup and uuid in self.setup.new_sessions:
+                return self.setup.new_sessions[uuid]
+            self._session_cache[uuid] = self.project.sessions.get(uuid)
+        return self._session_cache[uuid]
+
     def set_branch_state(self, uuid, state):
         if uuid in self.new_branch_states:
             self.new_branch_states[uuid] = state
         else:
-            old = self.project.branches.get(uuid)
+            old = self.get_branch(uuid)
             self.new_branch_states[uuid] = state
             self.old_branch_states[uuid] = old.state
 
 
-    def set_session_state(self, session_uuid, state):
-        if session_uuid in self.new_session_states:
+    def set_session_state(self, uuid, state):
+        if uuid in self.new_session_states:
             self.new_session_states[uuid] = state
         else:
-            old = self.project.sessions.get(uuid)
+            old = self.get_session(uuid)
             self.new_session_states[uuid] = state
             self.old_session_states[uuid] = old.state
 
@@ -1505,11 +1805,20 @@ class SwitchTransaction:
         return value
 
     def action(self):
-        branches = dict(old=self.old_branch_states, new=self.new_branch_states)
-        sessions = dict(old=self.old_session_states, new=self.new_session_states)
-        names = dict(old=self.old_names, new=self.new_names)
-        states = dict(old=self.old_states, new=self.new_states)
-        return objects.Switch(self.now, self.command, self.prefix, self.active_session, sessions, branches, names, states)
+        # empty categories are recorded as {}, see apply_logical_changes
+        def changes(old, new):
+            return dict(old=old, new=new) if new else {}
+        branches = changes(self.old_branch_states, self.new_branch_states)
+        sessions = changes(self.old_session_states, self.new_session_states)
+        names = changes(self.old_names, self.new_names)
+        states = changes(self.old_states, self.new_states)
+        setup = None
+        if self.setup:
+            setup = self.setup.action()
+            if any(setup.blobs.values()) or setup.working:
+                raise VexBug(setup.blobs)
+        return objects.Switch(self.now, self.command, self.prefix, self.active_session, sessions, branches, names, states,
+                changes=setup.changes if setup else None)
 
 class Project:
     VEX = "/.vex"
@@ -1531,14 +1840,66 @@ class Project:
         self.history =   History(os.path.join(config_dir, 'history'), pickle_codec)
         self.lockfile =  LockFile(os.path.join(config_dir, 'lock'))
         self._lock = None
-
-        self.settings =  FileStore(os.path.join(config_dir, 'settings'), codec, rawkeys=['template'])
+        self._io_pool = None
+        self._io_workers = None
+        self._listing_cache = collections.OrderedDict()
+        self.stat_cache = StatCache(os.path.join(config_dir, 'statcache'), pickle_codec)
+
+        # the working copy's .vex, so files can be rewritten by switches or by hand
+        self.settings =  FileStore(os.path.join(config_dir, 'settings'), codec, rawkeys=['template'], cache_parsed=True)
+
+        # Action.changes key -> (store, message for a fake run)
+        self._physical_stores = {
+            'branches': (self.branches, 'would set branch {} to {}\n'),
+            'names': (self.names, 'would set branch name {} to {}\n'),
+            'sessions': (self.sessions, 'would set session {} to {}\n'),
+            'settings': (self.settings, 'would set {} setting to {}\n'),
+            'states': (self.state, 'would set {} state to {}\n'),
+        }
+        self._replay_handlers = {
+            objects.Action: self._replay_action,
+            objects.Switch: self._replay_switch,
+        }
+        # Action.blobs key -> (copy from scratch, message for a fake run)
+        self._blob_copiers = {
+            'commits': (self.repo.add_commits_from_scratch, 'would add commit {}\n'),
+            'manifests': (self.repo.add_manifests_from_scratch, 'would add manifest {}\n'),
+            'files': (self.repo.add_files_from_scratch, 'would add files {}\n'),
+        }
 
     # methods, look, don't ask, they're just plain methods, ok?
 
     def nfc_name(self, name):
         return unicodedata.normalize('NFC', name)
 
+    def io_pool(self):
+        # shared by everything that stats, hashes or copies files
+        if self._io_pool is None:
+            self._io_workers = max(8, (os.cpu_count() or 1) * 2)
+            self._io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._io_workers, thread_name_prefix='vex-io')
+        return self._io_pool
+
+    def each_in_pool(self, fn, items):
+        """ call fn(*item) for every item, as one task per worker rather than one per item """
+        executor = self.io_pool()
+        items = list(items)
+        chunks = [items[i::self._io_workers] for i in range(self._io_workers)]
+        def run(chunk):
+            # a failure doesn't stop the other items, but is reported once all are done
+            errors = []
+            for item in chunk:
+                try:
+                    fn(*item)
+                except Exception as e:
+                    errors.append(e)
+            return errors
+        futures = [executor.submit(run, chunk) for chunk in chunks if chunk]
+        concurrent.futures.wait(futures)
+        for future in futures:
+            errors = future.result()
+            if errors:
+                raise errors[0]
+
     def makedirs(self):
         os.makedirs(self.config_dir, exist_ok=True)
         self.repo.makedirs()
@@ -1557,9 +1918,17 @@ class Project:
         """ a process wide lock, ok?"""
         with self.lockfile(command) as locked:
             self._lock = locked
+            # not settings, those live in the working copy and get swapped out underneath
+            stores = (self.branches, self.names, self.sessions, self.state)
+            for store in stores:
+                store.remember()
             try:
                 yield self
             finally:
+                for store in stores:
+                    store.forget()
+                if not self.fake:
+                    self.stat_cache.save()
                 self._lock = None
 
     def exists(self):
@@ -1588,8 +1957,19 @@ class Project:
     def get_session(self, uuid):
         return self.sessions.get(uuid)
 
-    def addr_for_file(self, file):
-        return self.repo.addr_for_file(file)
+    def get_sessions(self, uuids):
+        return self.sessions.get_many(uuids, map=self.io_pool().map)
+
+    def addr_for_file(self, file, st=None):
+        # skip hashing when the file looks the same as last time it was hashed
+        if st is None:
+            st = os.stat(file)
+        addr = self.stat_cache.get(file, st)
+        if addr is None:
+            addr = self.repo.addr_for_file(file)
+            if time_ns() - st.st_mtime_ns >= MTIME_GRACE_NS:
+                self.stat_cache.set(file, st, addr)
+        return addr
 
     def get_commit(self, addr):
         return self.repo.get_commit(addr)
@@ -1618,23 +1998,29 @@ class Project:
     def put_scratch_file(self, value, addr=None):
         return self.repo.put_scratch_file(value, addr)
 
+    def put_scratch_buf(self, buf):
+        return self.repo.put_scratch_buf(buf)
+
 
     def check_files(self, files):
         output = []
+        working_dir, config_dir = self.working_dir, self.config_dir
         for filename in files:
-            filename = os.path.normpath(filename)
-            if not filename.startswith(self.working_dir):
+            # most paths are already normal, normpath only when it could change something
+            if '//' in filename or '/.' in filename or filename.endswith('/'):
+                filename = os.path.normpath(filename)
+            if not _inside(filename, working_dir):
                 raise VexError("{} is outside project".format(filename))
-            if filename == self.config_dir: continue
+            if filename == config_dir: continue
             output.append(filename)
-        return files
+        return output
 
     def check_file(self, file):
         if not file.startswith(self.working_dir):
             return False
-        if os.path.commonpath((self.settings.dir, file)) == self.settings.dir:
+        if _inside(file, self.settings.dir):
             return True
-        if os.path.commonpath((self.config_dir, file)) == self.config_dir:
+        if _inside(file, self.config_dir):
             return False
         return True
 
@@ -1655,7 +2041,8 @@ class Project:
                     self.apply_physical_changes('old', action.changes)
                 elif isinstance(action, objects.Switch):
                     # raise VexUnimplemented('this should probably pass but ...')
-                    pass
+                    if mode == 'do' and getattr(action, 'changes', None):
+                        self.apply_physical_changes('old', action.changes)
                 else:
                     raise VexBug('welp')
             return action
@@ -1667,7 +2054,8 @@ class Project:
                     self.copy_blobs(action.blobs)
                     self.apply_physical_changes('new', action.changes)
                 elif isinstance(action, objects.Switch):
-                    pass
+                    if mode == 'do' and getattr(action, 'changes', None):
+                        self.apply_physical_changes('new', action.changes)
                 else:
                     raise VexBug('welp')
             return action
@@ -1683,7 +2071,13 @@ class Project:
         except Cancel as e:
             txn.cancelled = True
             return
-        with self.history.do_without_undo(txn.action(), self.fake) as action:
+        action = txn.action()
+        if not (action.changes or action.blobs or action.working):
+            # nothing was written, so there's nothing to log or replay
+            if not self.history.clean_state():
+                raise VexCorrupt('Project history not in a clean state.')
+            return
+        with self.history.do_without_undo(action, self.fake) as action:
             if any(action.blobs.values()):
                 raise VexBug(action.blobs)
             if action.changes:
@@ -1705,7 +2099,7 @@ class Project:
                 return
             if isinstance(action, objects.Action):
                 self.copy_blobs(action.blobs)
-                self.apply_working_changes('new', action.working)
+                self.apply_working_changes('new', action.working, stored=action.blobs.get('files'))
                 self.apply_physical_changes('new', action.changes)
             else:
                 raise VexBug('action')
@@ -1721,10 +2115,31 @@ class Project:
         except Cancel as e:
             txn.cancelled = True
             return
+        self._do_switch_action(txn)
+
+    @contextmanager
+    def do_create_and_switch(self, command):
+        """ like do_switch, but yields (setup, txn) where branches and sessions
+        created through setup are written in the same history entry as the switch """
+        if not self.history.clean_state():
+            raise VexCorrupt('Project history not in a clean state.')
+
+        setup = SessionTransaction(self, command)
+        txn = SwitchTransaction(self, command, setup)
+        try:
+            yield setup, txn
+        except Cancel as e:
+            txn.cancelled = True
+            return
+        self._do_switch_action(txn)
+
+    def _do_switch_action(self, txn):
         with self.history.do(txn.action(), self.fake) as action:
             if not action:
                 return
             if isinstance(action, objects.Switch):
+                if action.changes:
+                    self.apply_physical_changes('new', action.changes)
                 self.apply_switch('new', action.prefix, action.active)
                 self.apply_logical_changes('new', action.session_states, action.branch_states, action.names, action.states)
             else:
@@ -1734,41 +2149,43 @@ class Project:
         with self.history.undo(self.fake) as action:
             if not action:
                 return
-            if isinstance(action, objects.Action):
-                self.apply_physical_changes('old', action.changes)
-                self.apply_working_changes('old', action.working)
-            elif isinstance(action, objects.Switch):
-                self.apply_switch('old', action.prefix, action.active)
-                self.apply_logical_changes('old', action.session_states, action.branch_states, action.names, action.states)
-            else:
-                raise VexBug('action')
+            self.replay('old', action)
             return action
 
-    def list_undos(self):
-        return self.history.entries()
+    def list_undos(self, limit=None):
+        return self.history.entries(limit)
 
     def redo(self, choice):
         with self.history.redo(choice, self.fake) as action:
             if not action:
                 return
-            if isinstance(action, objects.Action):
-                self.apply_physical_changes('new', action.changes)
-                self.apply_working_changes('new', action.working)
-            elif isinstance(action, objects.Switch):
-                self.apply_switch('new', action.prefix, action.active)
-                self.apply_logical_changes('new', action.session_states, action.branch_states, action.names, action.states)
-            else:
-                raise VexBug('action')
+            self.replay('new', action)
             return action
 
-    def list_redos(self):
-        return self.history.redo_choices()
+    def list_redos(self, limit=None):
+        return self.history.redo_choices(limit)
+
+    # undo/redo: apply either side of a recorded entry
+    def replay(self, kind, action):
+        handler = self._replay_handlers.get(type(action))
+        if handler is None:
+            raise VexBug('action')
+        handler(kind, action)
+
+    def _replay_action(self, kind, action):
+        self.apply_physical_changes(kind, action.changes)
+        self.apply_working_changes(kind, action.working)
+
+    def _replay_switch(self, kind, action):
+        # action.changes stay as they are, like a do_without_undo entry
+        self.apply_switch(kind, action.prefix, action.active)
+        self.apply_logical_changes(kind, action.session_states, action.branch_states, action.names, action.states)
 
     # Take Action.changes and applies them to project
     def apply_logical_changes(self, kind, session_states, branch_states, names, states):
         if not self._lock:
             raise VexBug('unlocked')
-        for name,value in session_states[kind].items():
+        for name,value in session_states.get(kind, {}).items():
             if self.fake:
                 sys.stderr.write('would set session {} state to {}\n'.format(name, value))
             else:
@@ -1776,19 +2193,19 @@ class Project:
                 session.state = value
                 self.sessions.set(name, session)
             
-        for name,value in branch_states[kind].items():
+        for name,value in branch_states.get(kind, {}).items():
             if self.fake:
                 sys.stderr.write('would set branch {} state to {}\n'.format(name, value))
             else:
                 branch = self.branches.get(name)
                 branch.state = value
                 self.branches.set(name, branch)
-        for name,value in names[kind].items():
+        for name,value in names.get(kind, {}).items():
             if self.fake:
                 sys.stderr.write('would set branch name {} to {}\n'.format(name, value))
             else:
                 self.names.set(name, value)
-        for name,value in states[kind].items():
+        for name,value in states.get(kind, {}).items():
             if self.fake:
                 sys.stderr.write('would set state {} to {}\n'.format(name, value))
             else:
@@ -1798,47 +2215,31 @@ class Project:
     def apply_physical_changes(self, kind, changes):
         if not self._lock:
             raise VexBug('unlocked')
-        prefix = self.prefix()
-        for key in changes:
-            if key == 'branches':
-                for name,value in changes['branches'][kind].items():
-                    if self.fake:
-                        sys.stderr.write('would set branch {} to {}\n'.format(name, value))
-                    else:
-                        self.branches.set(name, value)
-            elif key == 'names':
-                for name,value in changes['names'][kind].items():
-                    if self.fake:
-                        sys.stderr.write('would set branch name {} to {}\n'.format(name, value))
-                    else:
-                        self.names.set(name, value)
-            elif key == 'sessions':
-                for name,value in changes['sessions'][kind].items():
-                    if self.fake:
-                        sys.stderr.write('would set session {} to {}\n'.format(name, value))
-                    else:
-                        self.sessions.set(name, value)
-            elif key == 'settings':
-                for name,value in changes['settings'][kind].items():
-                    if self.fake:
-                        sys.stderr.write('would set {} setting to {}\n'.format(name, value))
-                    else:
-                        self.settings.set(name, value)
-            elif key == 'states':
-                for name,value in changes['states'][kind].items():
-                    if self.fake:
-                        sys.stderr.write('would set {} state to {}\n'.format(name, value))
-                    else:
-                        self.state.set(name, value)
-            else:
+        for key, values in changes.items():
+            if key not in self._physical_stores:
                 raise VexBug(key)
+            store, message = self._physical_stores[key]
+            if self.fake:
+                for name,value in values[kind].items():
+                    sys.stderr.write(message.format(name, value))
+            else:
+                # one file per record, so write a store's records side by side
+                items = values[kind].items()
+                if len(items) > 1:
+                    list(self.io_pool().map(lambda item: store.set(*item), items))
+                else:
+                    for name,value in items:
+                        store.set(name, value)
 
-    def apply_working_changes(self, kind, changes):
+    def apply_working_changes(self, kind, changes, stored=None):
+        # stored: file addrs just moved into the object store, which
+        # can be copied out without looking in scratch first
         if not changes:
             return
         active = self.active()
+        stored = stored or ()
         dirs = set()
-        for name in sorted(changes[kind], key=lambda x: x.split('/')):
+        for name in sorted(changes[kind], key=_path_key):
             addr = changes[kind][name]
             path = active.repo_to_full_path(self, name)
             if kind == 'new':
@@ -1851,21 +2252,29 @@ class Project:
                 sys.stderr.write('would replace {} with {}\n'.format(path, addr))
                 continue
 
-            if old is None and not os.path.exists(path):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = None
+            if old is None and st is None:
                 if addr == "dir":
                     os.mkdir(path)
+                elif addr in stored:
+                    self.repo.copy_from_file(addr, path)
                 else:
                     self.repo.copy_from_any(addr, path)
-            elif old and os.path.isfile(path) and self.addr_for_file(path) == old:
+            elif old and st and S_ISREG(st.st_mode) and self.addr_for_file(path, st) == old:
                 os.remove(path)
-                if addr:
+                if addr in stored:
+                    self.repo.copy_from_file(addr, path)
+                elif addr:
                     self.repo.copy_from_any(addr, path)
-            elif old == "dir" and os.path.isdir(path):
+            elif old == "dir" and st and S_ISDIR(st.st_mode):
                 if addr is None:
                     dirs.add(path)
             else:
                 sys.stderr.write("ERR: Skipping {}\n".format(path))
-        for name in sorted(dirs, reverse=True, key=lambda x: x.split('/')):
+        for name in sorted(dirs, key=_deepest_first):
             os.rmdir(name)
 
 
@@ -1873,27 +2282,18 @@ class Project:
     def copy_blobs(self, blobs):
         if not self._lock:
             raise VexBug('unlocked')
-        for key in blobs:
-            if key == 'commits':
-                for addr in blobs['commits']:
-                    if self.fake:
-                        sys.stderr.write('would add commit {}\n'.format(addr))
-                    else:
-                        self.repo.add_commit_from_scratch(addr)
-            elif key == 'manifests':
-                for addr in blobs['manifests']:
-                    if self.fake:
-                        sys.stderr.write('would add manifest {}\n'.format(addr))
-                    else:
-                        self.repo.add_manifest_from_scratch(addr)
-            elif key =='files':
-                for addr in blobs['files']:
-                    if self.fake:
-                        sys.stderr.write('would add files {}\n'.format(addr))
-                    else:
-                        self.repo.add_file_from_scratch(addr)
-            else:
+        # each blob is copied independently, so overlap the copies, but
+        # finish one kind before starting the next
+        executor = self.io_pool()
+        for key, addrs in blobs.items():
+            if key not in self._blob_copiers:
                 raise VexBug('Project change has unknown values')
+            copy, message = self._blob_copiers[key]
+            if self.fake:
+                for addr in addrs:
+                    sys.stderr.write(message.format(addr))
+            else:
+                copy(addrs, map=executor.map)
 
     def apply_switch(self, kind, prefix, session):
         if not self._lock:
@@ -1934,33 +2334,33 @@ class Project:
             raise VexBug('no')
         dirs = set()
 
-        def process(name, entry):
-            if not entry.working:       return
-            if entry.kind in ('ignore', 'gitfile'):  return
-            path = session.repo_to_full_path(self, name)
-            entry.refresh(path, self.addr_for_file)
+        def process(name, entry, path, st):
+            if st is None:
+                entry.refresh(path, self.addr_for_file)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    pass
+            else:
+                entry.refresh_with_stat(path, st, self.addr_for_file)
 
-            if entry.kind in ('file',):
-                if os.path.commonpath((path, self.working_dir)) != self.working_dir:
+            if entry.kind == 'file':
+                if not _inside(path, self.working_dir):
                     raise VexBug('file outside of working dir inside tracked')
-                if entry.kind == 'deleted':
-                    return
-                if not os.path.isfile(path):
+                if st is None or not S_ISREG(st.st_mode):
                     raise VexBug('sync')
-                if entry.state in ('added', 'replaced', 'modified'):
+                if entry.state in _STASH_STATES:
                     entry.stash = self.put_scratch_file(path)
-                elif entry.state in ('tracked'):
+                elif entry.state == 'tracked':
                     pass
                 else:
                     raise VexBug('state')
 
                 os.remove(path)
             elif entry.kind == "dir":
-                if os.path.commonpath((path, self.working_dir)) != self.working_dir:
+                if not _inside(path, self.working_dir):
                     raise VexBug('file outside of working dir inside tracked')
-                if entry.kind == 'deleted':
-                    return
-                if not os.path.isdir(path):
+                if st is None or not S_ISDIR(st.st_mode):
                     raise VexBug('sync')
                 if name in ("/", self.VEX): 
                     return
@@ -1972,11 +2372,17 @@ class Project:
             entry.mtime = None
             entry.mode = None
             entry.size = None
-        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-            for name, entry in session.files.items():
-                executor.submit(process, name, entry)
 
-        for dir in sorted(dirs, reverse=True, key=lambda x: x.split("/")):
+        work = []
+        for name, entry in session.files.items():
+            if not entry.working:       continue
+            if entry.kind in ('ignore', 'gitfile'):  continue
+            work.append((name, entry, session.repo_to_full_path(self, name)))
+        # one scandir per directory rather than a stat per file
+        stats = _bulk_stat(path for name, entry, path in work)
+        self.each_in_pool(process, ((name, entry, path, stats.get(path)) for name, entry, path in work))
+
+        for dir in sorted(dirs, key=_deepest_first):
             if dir in (self.working_dir, self.settings.dir):
                 continue
             if not os.path.isdir(dir):
@@ -2016,13 +2422,14 @@ class Project:
             else:
                 raise VexBug('kind')
 
-        files = {}
-        for name in sorted(session.files, key=lambda x:x.split('/')):
-            entry = session.files[name]
+        # makedirs creates any missing parents, so the order doesn't matter
+        dirs = []
+        files = []
+        for name, entry in session.files.items():
             entry.mtime = None
             entry.mode = None
             entry.size = None
-            if os.path.commonpath((name, prefix)) != prefix and os.path.commonpath((name, self.VEX)) != self.VEX:
+            if not _inside(name, prefix) and not _inside(name, self.VEX):
                 entry.working = None
                 continue
 
@@ -2034,14 +2441,13 @@ class Project:
 
             if entry.kind =='dir':
                 if name not in ('/', self.VEX, prefix):
-                    path = session.repo_to_full_path(self, name)
-                    os.makedirs(path, exist_ok=True)
+                    dirs.append(session.repo_to_full_path(self, name))
             else:
-                files[name] = entry
+                files.append((name, entry))
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-            for name, entry in files.items():
-                executor.submit(process, name, entry)
+        for path in dirs:
+            os.makedirs(path, exist_ok=True)
+        self.each_in_pool(process, files)
 
         self.sessions.set(session.uuid, session)
         self.state.set('prefix', prefix)
@@ -2075,50 +2481,52 @@ class Project:
 
         branch = self.get_branch(session.branch)
 
+        entries = []
         commit = session.prepare
-        out = []
         while commit != session.commit:
+            if len(entries) >= count:
+                commit = None
+                break
             obj = self.get_commit(commit)
-            message = ""
-            if obj.changeset is not None:
-                changes = self.get_manifest(obj.changeset)
-                if changes is not None:
-                    message = changes.message
-            ts = obj.timestamp
-            if ts:
-                ts= rson.format_datetime(ts)
-            out.append(' 0 {} 0x{} {}: {}'.format(ts,commit[4:12], obj.kind, message))
+            entries.append((' 0', commit, obj))
             commit = obj.previous
 
         n= -1
         while commit and (all or commit != branch.base):
             obj = self.get_commit(commit)
-            message = ""
-            if obj.changeset is not None:
-                changes = self.get_manifest(obj.changeset)
-                if changes is not None:
-                    message = changes.message
-            ts = obj.timestamp
-            if ts:
-                ts= rson.format_datetime(ts)
-            out.append('{} {} 0x{} {}: {}'.format(n, ts,commit[4:12],  obj.kind, message))
+            entries.append((n, commit, obj))
             commit = obj.previous
             if -n > count:
                 break
             n-=1
-            
+
+        # only the messages need the changesets, and those can be read together
+        messages = self.io_pool().map(self._log_message, [obj for n, commit, obj in entries])
+        out = []
+        for (n, commit, obj), message in zip(entries, messages):
+            ts = obj.timestamp
+            if ts:
+                ts= rson.format_datetime(ts)
+            out.append('{} {} 0x{} {}: {}'.format(n, ts, commit[4:12], obj.kind, message))
         return out
 
+    def _log_message(self, obj):
+        if obj.changeset is not None:
+            changes = self.get_manifest(obj.changeset)
+            if changes is not None:
+                return changes.message
+        return ""
+
     def status(self):
         with self.do_without_undo('status') as txn:
             return txn.refresh_active().files
 
     def switch(self, new_prefix):
-        # check new prefix exists in repo
-        if os.path.commonpath((new_prefix, self.VEX )) == self.VEX:
-            raise VexArgument('bad arg')
+        # check new prefix exists in repo, after which it's known to be normalised
         if new_prefix not in self.active().files and new_prefix != "/":
             raise VexArgument('bad prefix')
+        if _inside(new_prefix, self.VEX):
+            raise VexArgument('bad arg')
         with self.do_switch('switch') as txn:
             txn.switch_prefix(new_prefix)
         # XXX: check switch succeeded
@@ -2130,14 +2538,6 @@ class Project:
             raise VexNoHistory('cant reinit')
         if not prefix.startswith('/'):
             raise VexArgument('crap prefix')
-        with self.do_without_undo('init') as txn:
-            # XXX: DOUBLE TXN so addr for file is easy, ugh
-            txn.set_setting('ignore', ignore)
-            txn.set_setting('include', include)
-            txn.set_setting('template', '')
-            txn.set_setting('authors', {})
-            txn.set_state('message', '')
-
         with self.do('init') as txn:
             author_uuid = UUID() 
             branch_uuid = UUID()
@@ -2146,9 +2546,11 @@ class Project:
 
             root_path = '/'
 
-            ignore_addr = txn.put_file(self.settings.filename('ignore'))
-            include_addr = txn.put_file(self.settings.filename('include'))
-            template_addr = txn.put_file(self.settings.filename('template'))
+            ignore_addr = txn.stage_setting('ignore', ignore)
+            include_addr = txn.stage_setting('include', include)
+            template_addr = txn.stage_setting('template', '')
+            txn.set_setting('authors', {})
+            txn.set_state('message', '')
             
             changes = {
                     '/' : [ objects.AddDir(properties={}) ] ,
@@ -2174,7 +2576,7 @@ class Project:
 
             files = txn.build_files(commit_uuid)
             for name, entry in files.items():
-                if os.path.commonpath((name, prefix)) == prefix or os.path.commonpath((name, self.VEX)) == self.VEX:
+                if _inside(name, prefix) or _inside(name, self.VEX):
                     entry.working = True
                 else:
                     entry.working = None
@@ -2186,6 +2588,12 @@ class Project:
             txn.set_state("active", session_uuid)
             txn.set_state("prefix", prefix)
 
+    def diff_files(self, output):
+        # each diff is its own subprocess, so run them side by side
+        names = list(output)
+        diffs = self.io_pool().map(lambda name: file_diff(name, output[name]['old'], output[name]['new']), names)
+        return {name: df for name, df in zip(names, diffs) if df}
+
     def active_diff_files(self, files):
         files = self.check_files(files) if files else None
         if self.git:
@@ -2214,12 +2622,7 @@ class Project:
                     e = session.files[name]
                     if e.kind == 'file' and e.addr:
                         output[name] = dict(old=self.repo.get_file_path(e.addr), new=session.repo_to_full_path(self,name))
-                output2 = {}
-                for name, d in output.items():
-                    df= file_diff(name, d['old'], d['new'])
-                    if df: 
-                        output2[name] = df
-                return output2
+                return self.diff_files(output)
 
 
     def active_diff_commit(self, commit):
@@ -2233,12 +2636,8 @@ class Project:
                 e = files[name]
                 if e.kind == 'file' and e.addr:
                     output[name] = dict(old=self.repo.get_file_path(e.addr), new=session.repo_to_full_path(self, name))
-            output2 = {}
-            for name, d in output.items():
-                df = file_diff(name, d['old'], d['new'])
-                if df:
-                    output2[name] = df
-            return output2
+            return self.diff_files(output)
+
     def prepare(self, files):
         files = self.check_files(files) if files else None
         with self.do('prepare') as txn:
@@ -2348,60 +2747,61 @@ class Project:
             dirs, files = txn.find_new_files(session, files, include, ignore)
             return files.values()
 
-    def add(self, files, include=None, ignore=None):
+    def _apply_files(self, command, files, fn):
         files = self.check_files(files)
 
-        with self.do('add') as txn:
+        with self.do(command) as txn:
             session = txn.refresh_active()
-            include = include if include is not None else txn.get_setting('include')
-            ignore = ignore if ignore is not None else txn.get_setting('ignore')
+            return fn(txn, files)
 
-            added = txn.add_files_to_active(files, include, ignore)
-            return added
+    def _add_files(self, txn, files, include=None, ignore=None):
+        include = include if include is not None else txn.get_setting('include')
+        ignore = ignore if ignore is not None else txn.get_setting('ignore')
+        return txn.add_files_to_active(files, include, ignore)
 
-    def forget(self, files):
-        files = self.check_files(files)
+    def add(self, files, include=None, ignore=None):
+        return self._apply_files('add', files, lambda txn, files: self._add_files(txn, files, include, ignore))
 
-        with self.do('forget') as txn:
-            session = txn.refresh_active()
-            changed = txn.forget_files_from_active(files)
-            return changed
+    def forget(self, files):
+        return self._apply_files('forget', files, SessionTransaction.forget_files_from_active)
 
     def remove(self, files):
-        files = self.check_files(files)
-
-        with self.do('remove') as txn:
-            session = txn.refresh_active()
-            changed = txn.remove_files_from_active(files)
-            return changed
+        return self._apply_files('remove', files, SessionTransaction.remove_files_from_active)
 
     def restore(self, files):
-        files = self.check_files(files)
-
-        with self.do('restore') as txn:
+        return self._apply_files('restore', files, SessionTransaction.restore_files_to_active)
+
+    def apply_file_ops(self, ops):
+        """ run [(op, files), ...] with op one of add, forget, remove, restore, as one undoable step """
+        fns = {
+            'add': self._add_files,
+            'forget': SessionTransaction.forget_files_from_active,
+            'remove': SessionTransaction.remove_files_from_active,
+            'restore': SessionTransaction.restore_files_to_active,
+        }
+        checked = []
+        for op, files in ops:
+            if op not in fns:
+                raise VexArgument('unknown file operation {}'.format(op))
+            checked.append((fns[op], self.check_files(files)))
+        with self.do('files:batch') as txn:
             session = txn.refresh_active()
-            changed = txn.restore_files_to_active(files)
-            return changed
+            return [fn(txn, files) for fn, files in checked]
 
     def list_branches(self):
-        branches = []
-        uuids = set()
-        for name in self.names.list():
-            uuid = self.names.get(name)
-            if uuid:
-                uuids.add(uuid)
-                branch = self.branches.get(uuid)
-                branches.append((name, branch))
-        for uuid in self.branches.list():
-            if uuid in uuids: continue
-            uuids.add(uuid)
-            branch = self.branches.get(uuid)
-            branches.append((None, branch))
+        executor = self.io_pool()
+        names = self.names.get_many(self.names.list(), map=executor.map)
+        named = set(uuid for uuid in names.values() if uuid)
+        unnamed = [uuid for uuid in self.branches.list() if uuid not in named]
+        found = self.branches.get_many(named.union(unnamed), map=executor.map)
+
+        branches = [(name, found[uuid]) for name, uuid in names.items() if uuid]
+        branches.extend((None, found[uuid]) for uuid in unnamed)
         return branches
 
     def swap_branch(self, name, rename=False, swap=False):
         with self.do('branch:swap') as txn:
-            active = self.active()
+            active = txn.active()
             me = txn.get_branch(active.branch)
             other = txn.get_branch_uuid(name)
             branch = txn.get_branch(other)
@@ -2415,7 +2815,7 @@ class Project:
 
     def rename_branch(self, name, rename=False, swap=False):
         with self.do('branch:rename') as txn:
-            active = self.active()
+            active = txn.active()
             old = txn.get_branch(active.branch)
             txn.set_branch_uuid(old.name, None)
             old.name = name
@@ -2424,11 +2824,11 @@ class Project:
 
     def save_as(self, name, rename=False, swap=False):
         with self.do('branch:saveas') as txn:
-            active = self.active()
+            active = txn.active()
             old = txn.get_branch(active.branch)
-            old.sessions.remove(active.uuid)
+            del old.sessions[active.uuid]
             buuid = UUID()
-            branch = objects.Branch(buuid, name, 'active', txn.prefix(), old.head, old.base, old.init, upstream=old, sessions=[active.uuid])
+            branch = objects.Branch(buuid, name, 'active', txn.prefix(), old.head, old.base, old.init, upstream=old.uuid, sessions=[active.uuid])
             active.branch = buuid
             txn.set_branch_uuid(name, branch.uuid)
             txn.put_session(active)
@@ -2436,13 +2836,13 @@ class Project:
             txn.put_branch(old)
 
     def open_branch(self, name, branch_uuid=None, session_uuid=None, create=False):
-        with self.do_without_undo('branch:open') as txn:
+        with self.do_create_and_switch('branch:open {}'.format(name)) as (txn, switch):
             # check for >1
             branch_uuid = txn.get_branch_uuid(name) if not branch_uuid else branch_uuid
             if branch_uuid is None:
                 if not create:
                     raise VexArgument('{} does not exist'.format(name))
-                active = self.active()
+                active = txn.active()
                 from_branch = active.branch
                 from_commit = active.commit
                 prefix = active.prefix
@@ -2450,29 +2850,25 @@ class Project:
                 branch_uuid = branch.uuid
             else:
                 branch = txn.get_branch(branch_uuid)
-            sessions = [txn.get_session(uuid) for uuid in branch.sessions]
             if session_uuid:
-                sessions = [s for s in sessions if s.uuid == session_uuid]
+                sessions = [txn.get_session(session_uuid)] if session_uuid in branch.sessions else []
             else:
-                sessions = [s for s in sessions if s.state == 'attached']
+                sessions = [s for s in txn.get_sessions(branch.sessions).values() if s.state == 'attached']
             if not sessions:
+                # adds itself to branch.sessions
                 session = txn.create_session(branch_uuid, 'attached', branch.head)
                 session_uuid = session.uuid
-                branch.sessions.append(session_uuid)
-                txn.put_branch(branch)
             elif len(sessions) == 1:
                 session_uuid = sessions[0].uuid
             else:
                 raise VexArgument('welp, too many attached sessions')
-        # XXX DOUBLE TXN
-        with self.do_switch('branch:open {}'.format(name)) as txn:
-            txn.switch_session(session_uuid)
+            switch.switch_session(session_uuid)
 
     def new_branch(self, name, from_branch=None, from_commit=None, fork=False):
-        with self.do_without_undo('branch:new') as txn:
+        with self.do_create_and_switch('branch:new {}'.format(name)) as (txn, switch):
             if txn.get_branch_uuid(name):
                 raise VexArgument('branch {} already exists'.format(name))
-            active = self.active()
+            active = txn.active()
             # bug: should pick commit from branch...
             if not from_branch: prefix = active.prefix
             if not from_branch: from_branch = active.branch
@@ -2480,27 +2876,22 @@ class Project:
             if not prefix: prefix = txn.get_branch(from_branch).prefix
             branch = txn.create_branch(name, prefix, from_commit, from_branch, fork)
             session = txn.create_session(branch.uuid, 'attached', branch.head)
-        # XXX DOUBLE TXN
-
-        with self.do_switch('branch:new {}'.format(name)) as txn:
-            txn.set_branch_state(branch.uuid, "active")
-            txn.switch_session(session.uuid)
-            txn.set_branch_uuid(name, branch.uuid)
+            switch.set_branch_state(branch.uuid, "active")
+            switch.switch_session(session.uuid)
+            switch.set_branch_uuid(name, branch.uuid)
 
     def list_sessions(self):
-        out = []
         active = self.active()
         branch = self.get_branch(active.branch)
-        for session in branch.sessions:
-            out.append(self.get_session(session))
-        return out
+        sessions = self.get_sessions(branch.sessions)
+        return [sessions[uuid] for uuid in branch.sessions]
 
     def append_changes_from_branch(self, name):
         with self.do('commit:append') as txn:
             branch_uuid = txn.get_branch_uuid(name)
             branch = txn.get_branch(branch_uuid)
 
-            active = self.active()
+            active = txn.active()
             active_branch_uuid = active.branch
             active_branch = txn.get_branch(active_branch_uuid)
 
@@ -2516,13 +2907,14 @@ class Project:
                 commit = obj.previous
             
             commits.reverse()
+            manifests = txn.get_manifests(commit.changeset for uuid, commit in commits)
             commit_uuid = active.prepare
             changeset = objects.Changeset({})
-            for uuid, commit in commits:
+            for (uuid, commit), manifest in zip(commits, manifests):
                 new_commit = objects.Commit(commit.kind, timestamp=txn.now, previous=commit_uuid, ancestors=dict(applied=uuid), root=commit.root, changeset=commit.changeset)
-                changeset.append_changes(txn.get_manifest(commit.changeset))
+                changeset.append_changes(manifest)
 
-                commit_uuid = txn.put_commit(commit)
+                commit_uuid = txn.put_commit(new_commit)
 
             txn.set_active_commit(commit_uuid)
 
@@ -2548,18 +2940,15 @@ class Project:
         with self.do_without_undo('git:clone') as txn:
 
             head = self.repo.head()
-            head_uuid = None
 
-            branches = self.repo.branches()
-            for name, commit in branches.items():
-                branch_uuid = UUID()
+            branches = []
+            for name, commit in self.repo.branches().items():
                 commit_uuid = "git:{}".format(commit)
-
-                branch = objects.Branch(branch_uuid, name, 'active', prefix, commit_uuid, None, commit_uuid, None, [])
-                txn.put_branch(branch)
-                txn.set_branch_uuid(name, branch.uuid)
-                if name == head:
-                    head_uuid = branch_uuid
+                branches.append(objects.Branch(UUID(), name, 'active', prefix, commit_uuid, None, commit_uuid, None, []))
+            txn.put_branches(branches)
+            names = collections.OrderedDict((branch.name, branch.uuid) for branch in branches)
+            txn.set_branch_uuids(names)
+            head_uuid = names.get(head)
 
             branch = txn.get_branch(head_uuid)
             session = txn.create_session(head_uuid, 'attached', branch.head)
@@ -2585,8 +2974,7 @@ class Project:
             raise VexNoHistory('cant reinit')
         if not prefix.startswith('/'):
             raise VexArgument('crap prefix')
-        with self.do_without_undo('init') as txn:
-            # XXX: DOUBLE TXN so addr for file is easy, ugh
+        with self.do('init') as txn:
             txn.set_setting('ignore', ignore)
             txn.set_setting('include', include)
             txn.set_setting('template', '')
@@ -2595,7 +2983,6 @@ class Project:
             txn.set_state("author", author_uuid)
             txn.set_setting('authors', {author_uuid:objects.Account(author_name, author_email)})
 
-        with self.do('init') as txn:
             branch_uuid = UUID()
             session_uuid = UUID()
             branch_name = 'master' # git compat *rolls eyes*
@@ -2622,7 +3009,7 @@ class Project:
 
             files = txn.build_files(commit_uuid)
             for name, entry in files.items():
-                if os.path.commonpath((name, prefix)) == prefix:
+                if _inside(name, prefix):
                     entry.working = True
                 else:
                     entry.working = None
@@ -279,8 +279,8 @@ Note: In this scheme, `@tag ["a",1]` and `@tag {"a":1}` encode to the same JSON,
 """
 
 import re
-import io
-import base64
+import binascii
+import struct
 import sys
 
 if sys.version_info.minor > 6 or sys.version_info.minor == 6 and sys.implementation.name == 'cpython':
@@ -290,6 +290,7 @@ else:
     from collections import namedtuple, OrderedDict
 
 from datetime import datetime, timedelta, timezone
+from itertools import chain
 
 
 CONTENT_TYPE="application/rson"
@@ -303,16 +304,15 @@ reserved_tags = set("""
         unknown
 """.split())
 
-whitespace = re.compile(r"(?:\ |\t|\uFEFF|\r|\n|#[^\r\n]*(?:\r?\n|$))+")
+# matches the empty string too, so .match(buf, pos).end() always skips to the next token
+whitespace = re.compile(r"(?:\ |\t|\uFEFF|\r|\n|#[^\r\n]*(?:\r?\n|$))*")
 
 int_b2 = re.compile(r"0b[01][01_]*")
 int_b8 = re.compile(r"0o[0-7][0-7_]*")
-int_b10 = re.compile(r"\d[\d_]*")
+# integer part, then optional fraction and exponent groups
+num_b10 = re.compile(r"\d[\d_]*(\.[\d_]+)?([eE][+-]?[\d_]+)?")
 int_b16 = re.compile(r"0x[0-9a-fA-F][0-9a-fA-F_]*")
 
-flt_b10 = re.compile(r"\.[\d_]+")
-exp_b10 = re.compile(r"[eE](?:\+|-)?[\d+_]")
-
 string_dq = re.compile(
     r'"(?:[^"\\\n\x00-\x1F\uD800-\uDFFF]|\\(?:[\'"\\/bfnrt]|\r?\n|x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}))*"')
 string_sq = re.compile(
@@ -336,17 +336,11 @@ str_escapes = {
     '\\': '\\',
 }
 
-byte_escapes = {
-    'b': b'\b',
-    'n': b'\n',
-    'f': b'\f',
-    'r': b'\r',
-    't': b'\t',
-    '/': b'/',
-    '"': b'"',
-    "'": b"'",
-    '\\': b'\\',
-}
+# keyed by byte value, for indexing into an encoded bytestring
+byte_escapes = {ord(c): e.encode('ascii') for c, e in str_escapes.items()}
+# every two-digit hex pair, for \xNN in bytestrings
+hex_pairs = {(a + b).encode('ascii'): int(a + b, 16)
+    for a in '0123456789abcdefABCDEF' for b in '0123456789abcdefABCDEF'}
 
 escaped = {
     '\b': '\\b',
@@ -359,23 +353,54 @@ escaped = {
     '\\': '\\\\',
 }
 
+# for str.translate: the escapes above, and \xNN for the other control characters
+escape_table = {i: '\\x{:02X}'.format(i) for i in range(0x20)}
+escape_table.update((ord(c), e) for c, e in escaped.items())
+
+# the escapes string_dq/string_sq accept, one group per kind
+str_escape = re.compile(
+    r'\\(?:([\'"\\/bfnrt])|x([0-9a-fA-F]{2})|u([0-9a-fA-F]{4})|U([0-9a-fA-F]{8})|(\r?\n))')
+
+
+def unescape_str(m, _str_escapes=str_escapes):
+    esc, x, u, U, nl = m.groups()
+    if esc is not None:
+        return _str_escapes[esc]
+    if x is not None:
+        return chr(int(x, 16))
+    if nl is not None:
+        return ''
+    n = int(u or U, 16)
+    if 0xD800 <= n <= 0xDFFF:
+        raise ValueError(m.start(), 'string cannot have surrogate pairs')
+    if n > 0x10FFFF:
+        raise ValueError(m.start(), 'string escape is past U+10FFFF')
+    return chr(n)
+
+# the layout format_datetime writes, %Y-%m-%dT%H:%M:%S[.%f]Z
+utc_datetime = re.compile(r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?Z\Z")
+
 builtin_names = {'null': None, 'true': True, 'false': False}
 builtin_values = {None: 'null', True: 'true', False: 'false'}
 
 # names -> Classes (take name, value as args)
-def parse_datetime(v):
+def parse_datetime(v, _utc_datetime=utc_datetime.match):
     if v[-1] == 'Z':
-        if '.' in v:
-            return datetime.strptime(v, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
-        else:
-            return datetime.strptime(v, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+        m = _utc_datetime(v)
+        if not m:
+            raise ValueError("Invalid UTC datetime: {}".format(repr(v)))
+        y, mo, d, h, mi, sec, frac = m.groups()
+        us = int(frac.ljust(6, '0')) if frac else 0
+        return datetime(int(y), int(mo), int(d), int(h), int(mi), int(sec), us, tzinfo=timezone.utc)
     else:
         raise NotImplementedError()
 
 
-def format_datetime(obj):
-    obj = obj.astimezone(timezone.utc)
-    return obj.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+def format_datetime(obj, _utc=timezone.utc):
+    obj = obj.astimezone(_utc)
+    # the layout utc_datetime reads, without going through strftime
+    return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}.{:06d}Z".format(
+        obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second, obj.microsecond)
 
 class ParserErr(Exception):
     def __init__(self, buf, pos, reason=None):
@@ -396,14 +421,24 @@ class Codec:
     def __init__(self, object_to_tagged, tagged_to_object):
         self.object_to_tagged = object_to_tagged
         self.tagged_to_object = tagged_to_object
+        # first character of a value -> parse method
+        self.parsers = {'{': self.parse_object, '[': self.parse_list, '"': self.parse_string, "'": self.parse_string}
+        self.parsers.update(dict.fromkeys('-+0123456789', self.parse_number))
+        # exact type of a value -> dump method, OrderedDict may be dict so goes last
+        self.dumpers = {
+            bool: self.dump_builtin, type(None): self.dump_builtin,
+            str: self.dump_str, int: self.dump_int, float: self.dump_float,
+            complex: self.dump_complex, bytes: self.dump_bytes, bytearray: self.dump_bytes,
+            list: self.dump_list, tuple: self.dump_list, set: self.dump_set,
+            dict: self.dump_dict, OrderedDict: self.dump_object,
+            datetime: self.dump_datetime, timedelta: self.dump_duration,
+        }
 
     def parse(self, buf, transform=None):
-        obj, pos = self.parse_rson(buf, 0, transform)
+        pos = whitespace.match(buf, 0).end()
+        obj, pos = self.parse_rson(buf, pos, transform)
 
-        m = whitespace.match(buf, pos)
-        if m:
-            pos = m.end()
-            m = whitespace.match(buf, pos)
+        pos = whitespace.match(buf, pos).end()
 
         if pos != len(buf):
             raise ParserErr(buf, pos, "Trailing content: {}".format(
@@ -413,465 +448,447 @@ class Codec:
 
 
     def dump(self, obj, transform=None):
-        buf = io.StringIO('')
-        self.dump_rson(obj, buf, transform)
-        buf.write('\n')
-        return buf.getvalue()
-
-    def parse_rson(self, buf, pos, transform=None):
-        m = whitespace.match(buf, pos)
-        if m:
-            pos = m.end()
-
+        buf = []
+        self.dump_rson(obj, buf.append, transform)
+        buf.append('\n')
+        return ''.join(buf)
+
+    # the defaults bind module globals as locals, these run for every value
+    # pos must already be past any whitespace, callers skip it to peek anyway
+    def parse_rson(self, buf, pos, transform=None, _tag_name=tag_name.match):
         peek = buf[pos]
         name = None
         if peek == '@':
-            m = tag_name.match(buf, pos)
+            m = _tag_name(buf, pos)
             if m:
                 pos = m.end()
                 name = buf[m.start() + 1:pos].rstrip()
             else:
                 raise ParserErr(buf, pos)
 
-        peek = buf[pos]
+            peek = buf[pos]
+            if peek == '@':
+                raise ParserErr(buf, pos, "Cannot nest tags")
 
-        if peek == '@':
-            raise ParserErr(buf, pos, "Cannot nest tags")
+        # dispatch on the first character, anything else is a builtin name
+        return self.parsers.get(peek, self.parse_builtin)(buf, pos, name, transform)
 
-        elif peek == '{':
-            if name in reserved_tags:
-                if name not in ('object', 'record', 'dict'):
-                    raise ParserErr(
-                        buf, pos, "{} can't be used on objects".format(name))
+    def parse_object(self, buf, pos, name, transform, _whitespace=whitespace.match, _reserved_tags=reserved_tags):
+        if name in _reserved_tags:
+            if name not in ('object', 'record', 'dict'):
+                raise ParserErr(
+                    buf, pos, "{} can't be used on objects".format(name))
 
-            if name == 'dict':
-                out = dict()
-            else:
-                out = OrderedDict()
+        if name == 'dict':
+            out = dict()
+        else:
+            out = OrderedDict()
 
-            pos += 1
-            m = whitespace.match(buf, pos)
-            if m:
-                pos = m.end()
+        pos += 1
+        pos = _whitespace(buf, pos).end()
 
-            while buf[pos] != '}':
-                key, pos = self.parse_rson(buf, pos, transform)
+        peek = buf[pos]
+        while peek != '}':
+            key, pos = self.parse_rson(buf, pos, transform)
 
-                if key in out:
-                    raise SemanticErr('duplicate key: {}, {}'.format(key, out))
+            if key in out:
+                raise SemanticErr('duplicate key: {}, {}'.format(key, out))
 
-                m = whitespace.match(buf, pos)
-                if m:
-                    pos = m.end()
+            pos = _whitespace(buf, pos).end()
 
-                peek = buf[pos]
-                if peek == ':':
-                    pos += 1
-                    m = whitespace.match(buf, pos)
-                    if m:
-                        pos = m.end()
-                else:
-                    raise ParserErr(
-                        buf, pos, "Expected key:value pair but found {}".format(repr(peek)))
+            peek = buf[pos]
+            if peek == ':':
+                pos += 1
+                pos = _whitespace(buf, pos).end()
+            else:
+                raise ParserErr(
+                    buf, pos, "Expected key:value pair but found {}".format(repr(peek)))
 
-                item, pos = self.parse_rson(buf, pos, transform)
+            item, pos = self.parse_rson(buf, pos, transform)
 
-                out[key] = item
+            out[key] = item
 
+            peek = buf[pos]
+            if peek == ',':
+                pos += 1
+                pos = _whitespace(buf, pos).end()
                 peek = buf[pos]
-                if peek == ',':
-                    pos += 1
-                    m = whitespace.match(buf, pos)
-                    if m:
-                        pos = m.end()
-                elif peek != '}':
-                    raise ParserErr(
-                        buf, pos, "Expecting a ',', or a '{}' but found {}".format('{}',repr(peek)))
-            if name not in (None, 'object', 'record', 'dict'):
-                out = self.tagged_to_object(name,  out)
-            if transform is not None:
-                out = transform(out)
-            return out, pos + 1
-
-        elif peek == '[':
-            if name in reserved_tags:
-                if name not in ('object', 'list', 'set', 'complex'):
-                    raise ParserErr(
-                        buf, pos, "{} can't be used on lists".format(name))
+            elif peek != '}':
+                raise ParserErr(
+                    buf, pos, "Expecting a ',', or a '{}' but found {}".format('{}',repr(peek)))
+        if name not in (None, 'object', 'record', 'dict'):
+            out = self.tagged_to_object(name,  out)
+        if transform is not None:
+            out = transform(out)
+        return out, pos + 1
+
+    def parse_list(self, buf, pos, name, transform, _whitespace=whitespace.match, _reserved_tags=reserved_tags):
+        if name in _reserved_tags:
+            if name not in ('object', 'list', 'set', 'complex'):
+                raise ParserErr(
+                    buf, pos, "{} can't be used on lists".format(name))
 
-            if name == 'set':
-                out = set()
-            else:
-                out = []
+        if name == 'set':
+            out = set()
+        else:
+            out = []
 
-            pos += 1
+        pos += 1
 
-            m = whitespace.match(buf, pos)
-            if m:
-                pos = m.end()
+        pos = _whitespace(buf, pos).end()
 
-            while buf[pos] != ']':
-                item, pos = self.parse_rson(buf, pos, transform)
-                if name == 'set':
-                    if item in out:
-                        raise SemanticErr('duplicate item in set: {}'.format(item))
-                    else:
-                        out.add(item)
+        peek = buf[pos]
+        while peek != ']':
+            item, pos = self.parse_rson(buf, pos, transform)
+            if name == 'set':
+                if item in out:
+                    raise SemanticErr('duplicate item in set: {}'.format(item))
                 else:
-                    out.append(item)
+                    out.add(item)
+            else:
+                out.append(item)
 
-                m = whitespace.match(buf, pos)
-                if m:
-                    pos = m.end()
+            pos = _whitespace(buf, pos).end()
 
+            peek = buf[pos]
+            if peek == ',':
+                pos += 1
+                pos = _whitespace(buf, pos).end()
                 peek = buf[pos]
-                if peek == ',':
-                    pos += 1
-                    m = whitespace.match(buf, pos)
-                    if m:
-                        pos = m.end()
-                elif peek != ']':
-                    raise ParserErr(
-                        buf, pos, "Expecting a ',', or a ']' but found {}".format(repr(peek)))
+            elif peek != ']':
+                raise ParserErr(
+                    buf, pos, "Expecting a ',', or a ']' but found {}".format(repr(peek)))
 
-            pos += 1
+        pos += 1
 
-            if name in (None, 'object', 'list', 'set'):
-                pass
-            elif name == 'complex':
-                out = complex(*out)
-            else:
-                out = self.tagged_to_object(name,  out)
+        if name in (None, 'object', 'list', 'set'):
+            pass
+        elif name == 'complex':
+            out = complex(*out)
+        else:
+            out = self.tagged_to_object(name,  out)
 
-            if transform is not None:
-                out = transform(out)
-            return out, pos
+        if transform is not None:
+            out = transform(out)
+        return out, pos
 
-        elif peek == "'" or peek == '"':
-            if name in reserved_tags:
-                if name not in ('object', 'string', 'float', 'datetime', 'bytestring', 'base64'):
-                    raise ParserErr(
-                        buf, pos, "{} can't be used on strings".format(name))
+    def parse_string(self, buf, pos, name, transform,
+            _string_dq=string_dq.match, _string_sq=string_sq.match, _reserved_tags=reserved_tags,
+            _byte_escapes=byte_escapes, _hex_pairs=hex_pairs, _str_escape=str_escape.sub,
+            _unescape_str=unescape_str):
+        peek = buf[pos]
+        if name in _reserved_tags:
+            if name not in ('object', 'string', 'float', 'datetime', 'bytestring', 'base64'):
+                raise ParserErr(
+                    buf, pos, "{} can't be used on strings".format(name))
 
-            if name == 'bytestring':
-                s = bytearray()
-                ascii = True
+        # validate string
+        if peek == "'":
+            m = _string_sq(buf, pos)
+            if m:
+                end = m.end()
             else:
-                s = io.StringIO()
-                ascii = False
-
-            # validate string
-            if peek == "'":
-                m = string_sq.match(buf, pos)
-                if m:
-                    end = m.end()
-                else:
-                    raise ParserErr(buf, pos, "Invalid single quoted string")
+                raise ParserErr(buf, pos, "Invalid single quoted string")
+        else:
+            m = _string_dq(buf, pos)
+            if m:
+                end = m.end()
             else:
-                m = string_dq.match(buf, pos)
-                if m:
-                    end = m.end()
-                else:
-                    raise ParserErr(buf, pos, "Invalid double quoted string")
+                raise ParserErr(buf, pos, "Invalid double quoted string")
 
-            lo = pos + 1  # skip quotes
-            while lo < end - 1:
-                hi = buf.find("\\", lo, end)
+        if name != 'bytestring':
+            try:
+                out = _str_escape(_unescape_str, buf[pos + 1:end - 1])
+            except ValueError as e:
+                raise ParserErr(buf, pos + 1 + e.args[0], e.args[1])
+        else:
+            raw = buf[pos + 1:end - 1].encode('ascii')  # skip quotes
+            s = bytearray()
+            lo, end2 = 0, len(raw)
+            while lo < end2:
+                hi = raw.find(b"\\", lo)
                 if hi == -1:
-                    if ascii:
-                        s.extend(buf[lo:end - 1].encode('ascii'))
-                    else:
-                        s.write(buf[lo:end - 1])  # skip quote
+                    s.extend(raw[lo:])
                     break
 
-                if ascii:
-                    s.extend(buf[lo:hi].encode('ascii'))
-                else:
-                    s.write(buf[lo:hi])
+                s.extend(raw[lo:hi])
 
-                esc = buf[hi + 1]
-                if esc in str_escapes:
-                    if ascii:
-                        s.extend(byte_escapes[esc])
-                    else:
-                        s.write(str_escapes[esc])
+                esc = raw[hi + 1]
+                if esc in _byte_escapes:
+                    s.extend(_byte_escapes[esc])
                     lo = hi + 2
-                elif esc == 'x':
-                    n = int(buf[hi + 2:hi + 4], 16)
-                    if ascii:
-                        s.append(n)
-                    else:
-                        s.write(chr(n))
+                elif esc == 0x78:  # x
+                    s.append(_hex_pairs[raw[hi + 2:hi + 4]])
                     lo = hi + 4
-                elif esc == 'u':
-                    n = int(buf[hi + 2:hi + 6], 16)
-                    if ascii:
-                        if n > 0xFF:
-                            raise ParserErr(
-                                buf, hi, 'bytestring cannot have escape > 255')
-                        s.append(n)
-                    else:
-                        if 0xD800 <= n <= 0xDFFF:
-                            raise ParserErr(
-                                buf, hi, 'string cannot have surrogate pairs')
-                        s.write(chr(n))
-                    lo = hi + 6
-                elif esc == 'U':
-                    n = int(buf[hi + 2:hi + 10], 16)
-                    if ascii:
-                        if n > 0xFF:
-                            raise ParserErr(
-                                buf, hi, 'bytestring cannot have escape > 255')
-                        s.append(n)
-                    else:
-                        if 0xD800 <= n <= 0xDFFF:
-                            raise ParserErr(
-                                buf, hi, 'string cannot have surrogate pairs')
-                        s.write(chr(n))
-                    lo = hi + 10
-                elif esc == '\n':
+                elif esc == 0x75 or esc == 0x55:  # u, U
+                    width = 4 if esc == 0x75 else 8
+                    n = int(raw[hi + 2:hi + 2 + width], 16)
+                    if n > 0xFF:
+                        raise ParserErr(
+                            buf, pos + 1 + hi, 'bytestring cannot have escape > 255')
+                    s.append(n)
+                    lo = hi + 2 + width
+                elif esc == 0x0A:  # \n
                     lo = hi + 2
-                elif (buf[hi + 1:hi + 3] == '\r\n'):
+                elif raw[hi + 1:hi + 3] == b'\r\n':
                     lo = hi + 3
                 else:
                     raise ParserErr(
-                        buf, hi, "Unkown escape character {}".format(repr(esc)))
+                        buf, pos + 1 + hi, "Unkown escape character {}".format(repr(chr(esc))))
 
-            if name == 'bytestring':
-                out = s
-            else:
-                out = s.getvalue()
-
-                if name in (None, 'string', 'object'):
-                    pass
-                elif name == 'base64':
-                    try:
-                        out = base64.standard_b64decode(out)
-                    except Exception as e:
-                        raise ParserErr(buf, pos, "Invalid base64") from e
-                elif name == 'datetime':
-                    try:
-                        out = parse_datetime(out)
-                    except Exception as e:
-                        raise ParserErr(
-                            buf, pos, "Invalid datetime: {}".format(repr(out))) from e
-                elif name == 'float':
-                    m = c99_flt.match(out)
-                    if m:
-                        out = float.fromhex(out)
-                    else:
-                        raise ParserErr(
-                            buf, pos, "invalid C99 float literal: {}".format(out))
+        if name == 'bytestring':
+            out = s
+        else:
+            if name in (None, 'string', 'object'):
+                pass
+            elif name == 'base64':
+                try:
+                    out = binascii.a2b_base64(out)
+                except Exception as e:
+                    raise ParserErr(buf, pos, "Invalid base64") from e
+            elif name == 'datetime':
+                try:
+                    out = parse_datetime(out)
+                except Exception as e:
+                    raise ParserErr(
+                        buf, pos, "Invalid datetime: {}".format(repr(out))) from e
+            elif name == 'float':
+                m = c99_flt.match(out)
+                if m:
+                    out = float.fromhex(out)
                 else:
-                    out = self.tagged_to_object(name,  out)
-
-            if transform is not None:
-                out = transform(out)
-            return out, end
-
-        elif peek in "-+0123456789":
-            if name in reserved_tags:
-                if name not in ('object', 'int', 'float', 'duration'):
                     raise ParserErr(
-                        buf, pos, "{} can't be used on numbers".format(name))
+                        buf, pos, "invalid C99 float literal: {}".format(out))
+            else:
+                out = self.tagged_to_object(name,  out)
+
+        if transform is not None:
+            out = transform(out)
+        return out, end
 
-            flt_end = None
-            exp_end = None
+    def parse_number(self, buf, pos, name, transform, _num_b10=num_b10.match, _reserved_tags=reserved_tags):
+        if name in _reserved_tags:
+            if name not in ('object', 'int', 'float', 'duration'):
+                raise ParserErr(
+                    buf, pos, "{} can't be used on numbers".format(name))
 
-            sign = +1
+        sign = +1
 
-            if buf[pos] in "+-":
-                if buf[pos] == "-":
-                    sign = -1
-                pos += 1
-            peek = buf[pos:pos + 2]
-
-            if peek in ('0x', '0o', '0b'):
-                if peek == '0x':
-                    base = 16
-                    m = int_b16.match(buf, pos)
-                    if m:
-                        end = m.end()
-                    else:
-                        raise ParserErr(
-                            buf, pos, "Invalid hexadecimal number (0x...)")
-                elif peek == '0o':
-                    base = 8
-                    m = int_b8.match(buf, pos)
-                    if m:
-                        end = m.end()
-                    else:
-                        raise ParserErr(buf, pos, "Invalid octal number (0o...)")
-                elif peek == '0b':
-                    base = 2
-                    m = int_b2.match(buf, pos)
-                    if m:
-                        end = m.end()
-                    else:
-                        raise ParserErr(
-                            buf, pos, "Invalid hexadecimal number (0x...)")
+        if buf[pos] in "+-":
+            if buf[pos] == "-":
+                sign = -1
+            pos += 1
+        peek = buf[pos:pos + 2]
 
-                out = sign * int(buf[pos + 2:end].replace('_', ''), base)
-            else:
-                m = int_b10.match(buf, pos)
+        if peek in ('0x', '0o', '0b'):
+            if peek == '0x':
+                m = int_b16.match(buf, pos)
                 if m:
-                    int_end = m.end()
-                    end = int_end
+                    end = m.end()
                 else:
-                    raise ParserErr(buf, pos, "Invalid number")
-
-                t = flt_b10.match(buf, end)
-                if t:
-                    flt_end = t.end()
-                    end = flt_end
-
-                e = exp_b10.match(buf, end)
-                if e:
-                    exp_end = e.end()
-                    end = exp_end
-
-                if flt_end or exp_end:
-                    out = sign * float(buf[pos:end].replace('_', ''))
+                    raise ParserErr(
+                        buf, pos, "Invalid hexadecimal number (0x...)")
+            elif peek == '0o':
+                m = int_b8.match(buf, pos)
+                if m:
+                    end = m.end()
+                else:
+                    raise ParserErr(buf, pos, "Invalid octal number (0o...)")
+            elif peek == '0b':
+                m = int_b2.match(buf, pos)
+                if m:
+                    end = m.end()
                 else:
-                    out = sign * int(buf[pos:end].replace('_', ''), 10)
-
-            if name is None or name == 'object':
-                pass
-            elif name == 'duration':
-                out = timedelta(seconds=out)
-            elif name == 'int':
-                if flt_end or exp_end:
                     raise ParserErr(
-                        buf, pos, "Can't tag floating point with @int")
-            elif name == 'float':
-                if not isintance(out, float):
-                    out = float(out)
-            else:
-                out = self.tagged_to_object(name, out)
-
-            if transform is not None:
-                out = transform(out)
-            return out, end
+                        buf, pos, "Invalid hexadecimal number (0x...)")
 
+            # int() reads the 0x/0o/0b prefix itself
+            digits = buf[pos:end]
+            if '_' in digits:
+                digits = digits.replace('_', '')
+            out = sign * int(digits, 0)
         else:
-            m = identifier.match(buf, pos)
+            m = _num_b10(buf, pos)
             if m:
                 end = m.end()
-                item = buf[pos:end]
+                is_float = m.group(1) is not None or m.group(2) is not None
             else:
-                raise ParserErr(buf, pos)
+                raise ParserErr(buf, pos, "Invalid number")
 
-            if item not in builtin_names:
+            digits = buf[pos:end]
+            if '_' in digits:
+                digits = digits.replace('_', '')
+            if is_float:
+                out = sign * float(digits)
+            else:
+                out = sign * int(digits, 10)
+
+        if name is None or name == 'object':
+            pass
+        elif name == 'duration':
+            out = timedelta(seconds=out)
+        elif name == 'int':
+            if isinstance(out, float):
                 raise ParserErr(
-                    buf, pos, "{} is not a recognised built-in".format(repr(item)))
-
-            out = builtin_names[item]
+                    buf, pos, "Can't tag floating point with @int")
+        elif name == 'float':
+            if not isintance(out, float):
+                out = float(out)
+        else:
+            out = self.tagged_to_object(name, out)
 
-            if name is None or name == 'object':
-                pass
-            elif name == 'bool':
-                if item not in ('true', 'false'):
-                    raise ParserErr(buf, pos, '@bool can only true or false')
-            elif name in reserved_tags:
-                raise ParserErr(
-                    buf, pos, "{} has no meaning for {}".format(repr(name), item))
-            else:
-                out = self.tagged_to_object(name,  out)
+        if transform is not None:
+            out = transform(out)
+        return out, end
 
-            if transform is not None:
-                out = transform(out)
-            return out, end
+    def parse_builtin(self, buf, pos, name, transform,
+            _identifier=identifier.match, _builtin_names=builtin_names, _reserved_tags=reserved_tags):
+        m = _identifier(buf, pos)
+        if m:
+            end = m.end()
+            item = buf[pos:end]
+        else:
+            raise ParserErr(buf, pos)
 
-        raise ParserErr(buf, pos)
+        try:
+            out = _builtin_names[item]
+        except KeyError:
+            raise ParserErr(
+                buf, pos, "{} is not a recognised built-in".format(repr(item))) from None
+
+        if name is None or name == 'object':
+            pass
+        elif name == 'bool':
+            if out is None:
+                raise ParserErr(buf, pos, '@bool can only true or false')
+        elif name in _reserved_tags:
+            raise ParserErr(
+                buf, pos, "{} has no meaning for {}".format(repr(name), item))
+        else:
+            out = self.tagged_to_object(name,  out)
 
+        if transform is not None:
+            out = transform(out)
+        return out, end
 
 
-    def dump_rson(self, obj, buf, transform=None):
+    def dump_rson(self, obj, write, transform=None):
         if transform:
             obj = transform(obj)
-        if obj is True or obj is False or obj is None:
-            buf.write(builtin_values[obj])
+        dumper = self.dumpers.get(type(obj))
+        if dumper is not None:
+            dumper(obj, write, transform)
+        # subclasses of the types above, then tagged objects
         elif isinstance(obj, str):
-            buf.write('"')
-            for c in obj:
-                if c in escaped:
-                    buf.write(escaped[c])
-                elif ord(c) < 0x20:
-                    buf.write('\\x{:02X}'.format(ord(c)))
-                else:
-                    buf.write(c)
-            buf.write('"')
+            self.dump_str(obj, write, transform)
         elif isinstance(obj, int):
-            buf.write(str(obj))
+            self.dump_int(obj, write, transform)
         elif isinstance(obj, float):
-            hex = obj.hex()
-            if hex.startswith(('0', '-')):
-                buf.write(str(obj))
-            else:
-                buf.write('@float "{}"'.format(hex))
+            self.dump_float(obj, write, transform)
         elif isinstance(obj, complex):
-            buf.write("@complex [{}, {}]".format(obj.real, obj.imag))
+            self.dump_complex(obj, write, transform)
         elif isinstance(obj, (bytes, bytearray)):
-            buf.write('@base64 "')
-            # assume no escaping needed
-            buf.write(base64.standard_b64encode(obj).decode('ascii'))
-            buf.write('"')
+            self.dump_bytes(obj, write, transform)
         elif isinstance(obj, (list, tuple)):
-            buf.write('[')
-            first = True
-            for x in obj:
-                if first:
-                    first = False
-                else:
-                    buf.write(", ")
-                self.dump_rson(x, buf, transform)
-            buf.write(']')
+            self.dump_list(obj, write, transform)
         elif isinstance(obj, set):
-            buf.write('@set [')
-            first = True
-            for x in obj:
-                if first:
-                    first = False
-                else:
-                    buf.write(", ")
-                self.dump_rson(x, buf, transform)
-            buf.write(']')
+            self.dump_set(obj, write, transform)
         elif isinstance(obj, OrderedDict): # must be before dict
-            buf.write('{')
-            first = True
-            for k, v in obj.items():
-                if first:
-                    first = False
-                else:
-                    buf.write(", ")
-                self.dump_rson(k, buf, transform)
-                buf.write(": ")
-                self.dump_rson(v, buf, transform)
-            buf.write('}')
+            self.dump_object(obj, write, transform)
         elif isinstance(obj, dict):
-            buf.write('@dict {')
-            first = True
-            for k in sorted(obj.keys()):
-                if first:
-                    first = False
-                else:
-                    buf.write(", ")
-                self.dump_rson(k, buf, transform)
-                buf.write(": ")
-                self.dump_rson(obj[k], buf, transform)
-            buf.write('}')
+            self.dump_dict(obj, write, transform)
         elif isinstance(obj, datetime):
-            buf.write('@datetime "{}"'.format(format_datetime(obj)))
+            self.dump_datetime(obj, write, transform)
         elif isinstance(obj, timedelta):
-            buf.write('@duration {}'.format(obj.total_seconds()))
+            self.dump_duration(obj, write, transform)
         else:
             nv = self.object_to_tagged(obj)
             name, value = nv
             if not isinstance(value, OrderedDict) and isinstance(value, dict):
                 value = OrderedDict(value)
-            buf.write('@{} '.format(name))
-            self.dump_rson(value, buf, transform)  # XXX: prevent @foo @foo
-        
+            write('@{} '.format(name))
+            self.dump_rson(value, write, transform)  # XXX: prevent @foo @foo
+
+    def dump_builtin(self, obj, write, transform):
+        write(builtin_values[obj])
+
+    def dump_str(self, obj, write, transform):
+        write('"')
+        write(obj.translate(escape_table))
+        write('"')
+
+    def dump_int(self, obj, write, transform):
+        write(str(obj))
+
+    def dump_float(self, obj, write, transform):
+        hex = obj.hex()
+        if hex.startswith(('0', '-')):
+            write(str(obj))
+        else:
+            write('@float "{}"'.format(hex))
+
+    def dump_complex(self, obj, write, transform):
+        write("@complex [{}, {}]".format(obj.real, obj.imag))
+
+    def dump_bytes(self, obj, write, transform):
+        write('@base64 "')
+        # assume no escaping needed
+        write(binascii.b2a_base64(obj, newline=False).decode('ascii'))
+        write('"')
+
+    def dump_list(self, obj, write, transform):
+        write('[')
+        first = True
+        for x in obj:
+            if first:
+                first = False
+            else:
+                write(", ")
+            self.dump_rson(x, write, transform)
+        write(']')
+
+    def dump_set(self, obj, write, transform):
+        write('@set [')
+        first = True
+        for x in obj:
+            if first:
+                first = False
+            else:
+                write(", ")
+            self.dump_rson(x, write, transform)
+        write(']')
+
+    def dump_object(self, obj, write, transform):
+        write('{')
+        first = True
+        for k, v in obj.items():
+            if first:
+                first = False
+            else:
+                write(", ")
+            self.dump_rson(k, write, transform)
+            write(": ")
+            self.dump_rson(v, write, transform)
+        write('}')
+
+    def dump_dict(self, obj, write, transform):
+        write('@dict {')
+        first = True
+        for k in sorted(obj.keys()):
+            if first:
+                first = False
+            else:
+                write(", ")
+            self.dump_rson(k, write, transform)
+            write(": ")
+            self.dump_rson(obj[k], write, transform)
+        write('}')
+
+    def dump_datetime(self, obj, write, transform):
+        write('@datetime "{}"'.format(format_datetime(obj)))
+
+    def dump_duration(self, obj, write, transform):
+        write('@duration {}'.format(obj.total_seconds()))
 
 
 class BinaryCodec:
@@ -883,17 +900,30 @@ class BinaryCodec:
     FALSE = ord("n")
     NULL = ord("z")
     INT = ord("i")
-    FLOAT = ord("f")
+    FLOAT = ord("f")  # hex float text, still read but no longer written
+    FLOAT64 = ord("d")  # 8 byte little-endian IEEE 754, no END
     STRING = ord("u")
     BYTES = ord("b")
     LIST = ord("l")
     RECORD = ord("r")
     TAG = ord("t")
     END = 127
+    CLOSE = object()  # queued by dump_buf in place of a container's END
 
     def __init__(self, object_to_tagged, tagged_to_object):
         self.tags = object_to_tagged
         self.classes = tagged_to_object
+        # class -> (tag, __slots__ or None), filled in as classes are dumped
+        self.tag_info = {}
+        # exact type of a value -> dump method
+        self.dumpers = {
+            bool: self.dump_bool, type(None): self.dump_null,
+            int: self.dump_int, float: self.dump_float,
+            bytes: self.dump_bytes, bytearray: self.dump_bytes, str: self.dump_str,
+            list: self.dump_list, tuple: self.dump_list, dict: self.dump_record,
+            OrderedDict: self.dump_record, set: self.dump_set, complex: self.dump_complex,
+            datetime: self.dump_datetime, timedelta: self.dump_duration,
+        }
 
     def parse(self, buf):
         obj, offset = self.parse_buf(buf, 0)
@@ -903,149 +933,224 @@ class BinaryCodec:
         return self.dump_buf(obj, bytearray())
 
     def parse_buf(self, buf, offset=0):
-        peek = buf[offset]
-        if peek == self.TRUE:
-            return True, offset+1
-        elif peek == self.FALSE:
-            return False, offset+1
-        elif peek == self.NULL:
-            return None, offset+1
-        elif peek == self.INT:
-            end = buf.index(self.END, offset+1)
-            obj = buf[offset+1:end].decode('ascii')
-            return int(obj), end+1
-        elif peek == self.FLOAT:
-            end = buf.index(self.END, offset+1)
-            obj = buf[offset+1:end].decode('ascii')
-            return float.fromhex(obj), end+1
-        elif peek == self.BYTES:
-            size, end = self.parse_buf(buf, offset+1)
-            start, end = end, end+size
-            obj = buf[start:end]
-            end = buf.index(self.END, end)
-            return obj, end+1
-        elif peek == self.STRING:
-            size, end = self.parse_buf(buf, offset+1)
-            start, end = end, end+size
-            obj = buf[start:end].decode('utf-8')
-            end = buf.index(self.END, end)
-            return obj, end+1
-        elif peek == self.LIST:
-            size, start = self.parse_buf(buf, offset+1)
-            out = []
-            for _ in range(size):
-                value, start = self.parse_buf(buf, start)
-                out.append(value)
-            end = buf.index(self.END, start)
-            return out, end+1
-        elif peek == self.RECORD:
-            size, start = self.parse_buf(buf, offset+1)
-            out = {}
-            for _ in range(size):
-                key, start = self.parse_buf(buf, start)
-                value, start = self.parse_buf(buf, start)
-                out[key] = value
-
-            end = buf.index(self.END, start)
-            return out, end+1
-        elif peek == self.TAG:
-            tag, start = self.parse_buf(buf, offset+1)
-            value, start = self.parse_buf(buf, start)
-            end = buf.index(self.END, start)
-            if tag == 'set':
-                out = set(value)
-            elif tag == 'complex':
-                out = complex(*value)
-            elif tag == 'datetime':
-                out = parse_datetime(value)
-            elif tag == 'duration':
-                out = timedelta(seconds=value)
+        # lists, records and tags being filled are kept on a stack of
+        # [kind, items, remaining], rather than recursing per value
+        index, END = buf.index, self.END
+        unpack_float64 = struct.Struct('<d').unpack_from
+        stack = []
+        while True:
+            peek = buf[offset]
+            if peek == self.TRUE:
+                value, offset = True, offset+1
+            elif peek == self.FALSE:
+                value, offset = False, offset+1
+            elif peek == self.NULL:
+                value, offset = None, offset+1
+            elif peek == self.INT:
+                end = index(END, offset+1)
+                value, offset = int(buf[offset+1:end]), end+1
+            elif peek == self.FLOAT64:
+                value, = unpack_float64(buf, offset+1)
+                offset += 9
+            elif peek == self.FLOAT:
+                end = index(END, offset+1)
+                value, offset = float.fromhex(buf[offset+1:end].decode('ascii')), end+1
+            elif peek in (self.BYTES, self.STRING, self.LIST, self.RECORD):
+                # followed by the size, as an INT
+                end = index(END, offset+2)
+                size, offset = int(buf[offset+2:end]), end+1
+                if peek == self.BYTES or peek == self.STRING:
+                    value = buf[offset:offset+size]
+                    if peek == self.STRING:
+                        value = value.decode('utf-8')
+                    offset = index(END, offset+size)+1
+                elif size:
+                    stack.append([peek, [], size if peek == self.LIST else 2*size])
+                    continue
+                else:
+                    value, offset = ([] if peek == self.LIST else {}), index(END, offset)+1
+            elif peek == self.TAG:
+                stack.append([peek, [], 2])
+                offset += 1
+                continue
             else:
-                cls = self.classes[tag]
-                out = cls(**value)
-            return out, end+1
-
-
-        raise Exception('bad buf {}'.format(peek.encode('ascii')))
+                raise Exception('bad buf {!r}'.format(peek))
 
+            while stack:
+                frame = stack[-1]
+                frame[1].append(value)
+                frame[2] -= 1
+                if frame[2]:
+                    break
+                stack.pop()
+                kind, items = frame[0], frame[1]
+                if kind == self.LIST:
+                    value = items
+                elif kind == self.RECORD:
+                    items = iter(items)
+                    value = dict(zip(items, items))
+                else:
+                    tag, value = items
+                    if tag == 'set':
+                        value = set(value)
+                    elif tag == 'complex':
+                        value = complex(*value)
+                    elif tag == 'datetime':
+                        value = parse_datetime(value)
+                    elif tag == 'duration':
+                        value = timedelta(seconds=value)
+                    else:
+                        cls = self.classes[tag]
+                        value = cls(**value)
+                offset = index(END, offset)+1
+            else:
+                return value, offset
+
+    def dump_buf(self, obj, buf, _CLOSE=CLOSE, _END=END):
+        # containers write their header and hand back their items, and a
+        # CLOSE for each END they owe, to be worked through here in order
+        todo = [obj]
+        pop, dumpers = todo.pop, self.dumpers
+        while todo:
+            obj = pop()
+            if obj is _CLOSE:
+                buf.append(_END)
+                continue
+            dumper = dumpers.get(type(obj))
+            if dumper is None:
+                dumper = self.dumper_for(obj)
+            items = dumper(obj, buf)
+            if items:
+                items.reverse()
+                todo.extend(items)
+        return buf
 
-    def dump_buf(self, obj, buf):
-        if obj is True:
-            buf.append(self.TRUE)
-        elif obj is False:
-            buf.append(self.FALSE)
-        elif obj is None:
-            buf.append(self.NULL)
-        elif isinstance(obj, int):
-            buf.append(self.INT)
-            buf.extend(str(obj).encode('ascii'))
-            buf.append(self.END)
+    def dumper_for(self, obj):
+        # subclasses of the types in self.dumpers, then tagged objects
+        if isinstance(obj, int):
+            return self.dump_int
         elif isinstance(obj, float):
-            buf.append(self.FLOAT)
-            buf.extend(float.hex(obj).encode('ascii'))
-            buf.append(self.END)
+            return self.dump_float
         elif isinstance(obj, (bytes,bytearray)):
-            buf.append(self.BYTES)
-            self.dump_buf(len(obj), buf)
-            buf.extend(obj)
-            buf.append(self.END)
+            return self.dump_bytes
         elif isinstance(obj, (str)):
-            obj = obj.encode('utf-8')
-            buf.append(self.STRING)
-            self.dump_buf(len(obj), buf)
-            buf.extend(obj)
-            buf.append(self.END)
+            return self.dump_str
         elif isinstance(obj, (list, tuple)):
-            buf.append(self.LIST)
-            self.dump_buf(len(obj), buf)
-            for x in obj:
-                self.dump_buf(x, buf)
-            buf.append(self.END)
+            return self.dump_list
         elif isinstance(obj, (dict)):
-            buf.append(self.RECORD)
-            self.dump_buf(len(obj), buf)
-            for k,v in obj.items():
-                self.dump_buf(k, buf)
-                self.dump_buf(v, buf)
-            buf.append(self.END)
+            return self.dump_record
         elif isinstance(obj, (set)):
-            buf.append(self.TAG)
-            self.dump_buf("set", buf)
-            buf.append(self.LIST)
-            self.dump_buf(len(obj), buf)
-            for x in obj:
-                self.dump_buf(x, buf)
-            buf.append(self.END)
-            buf.append(self.END)
+            return self.dump_set
         elif isinstance(obj, complex):
-            buf.append(self.TAG)
-            self.dump_buf("complex", buf)
-            buf.append(self.LIST)
-            self.dump_buf(2, buf)
-            self.dump_buf(obj.real, buf)
-            self.dump_buf(obj.imag, buf)
-            buf.append(self.END)
-            buf.append(self.END)
+            return self.dump_complex
         elif isinstance(obj, datetime):
-            buf.append(self.TAG)
-            self.dump_buf("datetime", buf)
-            self.dump_buf(format_datetime(obj), buf)
-            buf.append(self.END)
+            return self.dump_datetime
         elif isinstance(obj, timedelta):
-            buf.append(self.TAG)
-            self.dump_buf("duration", buf)
-            self.dump_buf(obj.total_seconds(), buf)
-            buf.append(self.END)
-
+            return self.dump_duration
         elif obj.__class__ in self.tags:
-            tag = self.tags[obj.__class__].encode('ascii')
-            buf.append(self.TAG)
-            self.dump_buf(tag, buf)
-            self.dump_buf(obj.__dict__, buf)
-            buf.append(self.END)
+            return self.dump_tagged
         else:
             raise Exception('bad obj {!r}'.format(obj))
-        return buf
+
+    # the defaults bind the kind and END bytes, with headers preformatted
+    # so each goes out in one write (kind, then any size as an INT)
+    def dump_bool(self, obj, buf, _TRUE=TRUE, _FALSE=FALSE):
+        buf.append(_TRUE if obj else _FALSE)
+
+    def dump_null(self, obj, buf, _NULL=NULL):
+        buf.append(_NULL)
+
+    def dump_int(self, obj, buf, _int=b'%c%%d%c' % (INT, END)):
+        buf.extend(_int % obj)
+
+    def dump_float(self, obj, buf, _pack=struct.Struct('<Bd').pack, _FLOAT64=FLOAT64):
+        buf.extend(_pack(_FLOAT64, obj))
+
+    def dump_bytes(self, obj, buf, _bytes=b'%c%c%%d%c' % (BYTES, INT, END), _END=END):
+        buf.extend(_bytes % len(obj))
+        buf.extend(obj)
+        buf.append(_END)
+
+    def dump_str(self, obj, buf, _string=b'%c%c%%d%c%%s%c' % (STRING, INT, END, END)):
+        # strings are mostly short keys, so the payload goes in the same
+        # write as its header, while bytes below avoid copying the blob
+        obj = obj.encode('utf-8')
+        buf.extend(_string % (len(obj), obj))
+
+    def dump_list(self, obj, buf, _list=b'%c%c%%d%c' % (LIST, INT, END), _CLOSE=CLOSE, _END=END,
+            _int=b'%c%%d%c' % (INT, END), _pack=struct.Struct('<Bd').pack, _FLOAT64=FLOAT64,
+            _ints=frozenset([int]), _floats=frozenset([float])):
+        buf.extend(_list % len(obj))
+        # lists of only ints or only floats are written in one go
+        kinds = set(map(type, obj))
+        if kinds == _ints:
+            buf.extend(b''.join([_int % x for x in obj]))
+        elif kinds == _floats:
+            buf.extend(b''.join([_pack(_FLOAT64, x) for x in obj]))
+        else:
+            items = list(obj)
+            items.append(_CLOSE)
+            return items
+        buf.append(_END)
+
+    def dump_record(self, obj, buf, _record=b'%c%c%%d%c' % (RECORD, INT, END), _CLOSE=CLOSE):
+        buf.extend(_record % len(obj))
+        items = list(chain.from_iterable(obj.items()))
+        items.append(_CLOSE)
+        return items
+
+    def dump_set(self, obj, buf, _list=b'%c%c%%d%c' % (LIST, INT, END), _TAG=TAG, _CLOSE=CLOSE):
+        buf.append(_TAG)
+        self.dump_str("set", buf)
+        buf.extend(_list % len(obj))
+        items = list(obj)
+        items.append(_CLOSE)
+        items.append(_CLOSE)
+        return items
+
+    def dump_complex(self, obj, buf, _list=b'%c%c%%d%c' % (LIST, INT, END), _TAG=TAG, _END=END):
+        buf.append(_TAG)
+        self.dump_str("complex", buf)
+        buf.extend(_list % 2)
+        self.dump_float(obj.real, buf)
+        self.dump_float(obj.imag, buf)
+        buf.append(_END)
+        buf.append(_END)
+
+    def dump_tagged(self, obj, buf, _record=b'%c%c%%d%c' % (RECORD, INT, END), _TAG=TAG, _CLOSE=CLOSE):
+        cls = obj.__class__
+        info = self.tag_info.get(cls)
+        if info is None:
+            slots = getattr(cls, '__slots__', None)
+            if isinstance(slots, str):
+                slots = (slots,)
+            info = self.tag_info[cls] = (self.tags[cls], slots)
+        tag, slots = info
+        buf.append(_TAG)
+        self.dump_str(tag, buf)
+        if slots is None:
+            return [obj.__dict__, _CLOSE]
+        # no __dict__ to hand over, so write the record from the slots
+        buf.extend(_record % len(slots))
+        items = []
+        for name in slots:
+            items.append(name)
+            items.append(getattr(obj, name))
+        items.append(_CLOSE)
+        items.append(_CLOSE)
+        return items
+
+    def dump_datetime(self, obj, buf, _TAG=TAG, _END=END):
+        buf.append(_TAG)
+        self.dump_str("datetime", buf)
+        self.dump_str(format_datetime(obj), buf)
+        buf.append(_END)
+
+    def dump_duration(self, obj, buf, _TAG=TAG, _END=END):
+        buf.append(_TAG)
+        self.dump_str("duration", buf)
+        self.dump_float(obj.total_seconds(), buf)
+        buf.append(_END)
 
 
 if __name__ == '__main__':
@@ -1127,7 +1232,7 @@ b"
     test_parse("@complex [1,2]", 1 + 2j)
     test_parse("@bytestring 'foo'", b"foo")
     test_parse("@base64 '{}'".format(
-        base64.standard_b64encode(b'foo').decode('ascii')), b"foo")
+        binascii.b2a_base64(b'foo', newline=False).decode('ascii')), b"foo")
     test_parse("@float 'NaN'", float('NaN'))
     test_parse("@float '-inf'", float('-Inf'))
     obj = datetime.now().astimezone(timezone.utc)
@@ -1146,6 +1251,7 @@ b"
     test_parse_err('"foo', ParserErr)
     test_parse_err('"\uD800\uDD01"', ParserErr)
     test_parse_err(r'"\uD800\uDD01"', ParserErr)
+    test_parse_err(r'"\U00110000"', ParserErr)
 
     tests = [
         0, -1, +1,
@@ -1200,6 +1306,19 @@ b"
             if obj != out:
                 raise AssertionError(
                     'failed second trip {} != {}'.format(obj, out))
+
+    class Point:
+        __slots__ = ('x', 'y')
+        def __init__(self, x, y):
+            self.x, self.y = x, y
+        def __eq__(self, other):
+            return (self.x, self.y) == (other.x, other.y)
+
+    tcodec = BinaryCodec({Point: 'point'}, {'point': Point})
+    obj = [Point(1, "two"), {"p": Point(3.0, None)}]
+    out = tcodec.parse(tcodec.dump(obj))
+    if obj != out:
+        raise AssertionError('failed tagged trip {} != {}'.format(obj, out))
     print('tests passed')
 
 